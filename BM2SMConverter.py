@@ -6,14 +6,28 @@
 # Abandon all hope ye who enter here
 
 
+import atexit
 import sys
 from argparse import ArgumentParser
-from io import StringIO
-from os import makedirs, path
+from os import cpu_count, makedirs, path
 
 from tqdm import tqdm
 
-import bm2sm.BM_parser
+from modules.validation import VALIDATION_LEVELS, get_validation_level, set_validation_level
+
+# Validation level decides how functions are decorated, so it must be set before anything else is imported
+validation_parser = ArgumentParser(add_help=False)
+validation_parser.add_argument('--validation', choices=VALIDATION_LEVELS)
+validation_level = validation_parser.parse_known_args()[0].validation
+if validation_level:
+    set_validation_level(validation_level)
+
+import bm2sm.batch
+from bm2sm.OGG_converter import OGGConverter
+from bm2sm.manifest import Manifest
+from bm2sm.profiling import enable_profiling
+from bm2sm.progress import AggregateSink, JsonLinesSink, NullSink, TerminalSink, get_sink, set_sink
+from bm2sm.sample_cache import SampleCache
 
 tqdm.monitor_interval = 0
 
@@ -22,11 +36,26 @@ if __name__ == '__main__':
                                 add_help=True,
                                 allow_abbrev=True)
 
-    arg_parser.add_argument('-I', '--in_file',
-                            action='store',
-                            help='Path to file to be converted.',
-                            required=True,
-                            type=str)
+    inputs = arg_parser.add_mutually_exclusive_group(required=True)
+
+    inputs.add_argument('-I', '--in_file',
+                        action='store',
+                        help='Path to file to be converted.',
+                        type=str)
+
+    inputs.add_argument('-F', '--folder',
+                        action='store',
+                        help='Song directory to be converted into a single SM file with all of its charts as '
+                             'difficulties. Audio is baked once for all charts that play the same sounds.',
+                        type=str)
+
+    inputs.add_argument('-B', '--batch',
+                        action='store',
+                        help='Directories, globs or charts to be converted in batch. '
+                             'A value starting with @ is a file listing one such source per line. '
+                             'Directories are searched recursively for .bms, .bme and .bml files.',
+                        nargs='+',
+                        type=str)
 
     arg_parser.add_argument('-O', '--out_dir',
                             action='store',
@@ -55,26 +84,196 @@ if __name__ == '__main__':
     arg_parser.add_argument('-V', '--verbose',
                             action='store_true',
                             default=False,
-                            help='Verbose mode, will print all kinds of messages if set.')
+                            help='Verbose mode, will print all kinds of messages if set. Same as --progress terminal.')
+
+    arg_parser.add_argument('--progress',
+                            action='store',
+                            choices=['none', 'terminal', 'aggregate', 'json'],
+                            default=None,
+                            help='How progress is reported. none shows nothing. '
+                                 'terminal shows a bar for every stage of every chart. '
+                                 'aggregate shows a single bar of converted charts. '
+                                 'json writes every stage, message and converted chart as a line of JSON. '
+                                 'Default: terminal with --verbose, none otherwise.')
+
+    arg_parser.add_argument('--progress_file',
+                            action='store',
+                            default=None,
+                            help='File --progress json writes into. Default: Standard error.',
+                            type=str)
+
+    arg_parser.add_argument('-J', '--jobs',
+                            action='store',
+                            default=cpu_count() or 1,
+                            help='How many charts are converted at once in batch mode. '
+                                 'Default: Amount of CPU cores.',
+                            type=int)
+
+    arg_parser.add_argument('--encode_jobs',
+                            action='store',
+                            default=0,
+                            help='How many audio files are encoded at once in batch mode, apart from -J workers, '
+                                 'which go on parsing and mixing next charts meanwhile. '
+                                 'Default: 0, every worker encodes audio of its own chart.',
+                            type=int)
+
+    arg_parser.add_argument('--encode_queue',
+                            action='store',
+                            default=2,
+                            help='How many mixed tracks may wait for an encoder with --encode_jobs. '
+                                 'Workers do not take more charts while that many are waiting. Default: 2.',
+                            type=int)
+
+    arg_parser.add_argument('--incremental',
+                            action='store_true',
+                            default=False,
+                            help='Only convert charts that changed since they were last converted in batch mode, '
+                                 'as well as their samples, options or outputs. '
+                                 'Also resumes an interrupted batch.')
+
+    arg_parser.add_argument('--manifest',
+                            action='store',
+                            default=None,
+                            help='Database of converted charts used by --incremental. '
+                                 'Default: bm2sm_manifest.sqlite3 in --out_dir, or in current directory.',
+                            type=str)
+
+    arg_parser.add_argument('--decode_jobs',
+                            action='store',
+                            default=None,
+                            help='How many keysounds of a chart are decoded at once. '
+                                 '1 decodes them one by one as they are used. '
+                                 'Default: Amount of CPU cores, 1 in batch mode since charts are converted at once.',
+                            type=int)
+
+    arg_parser.add_argument('--cache_dir',
+                            action='store',
+                            default=None,
+                            help='Directory of a persistent cache of decoded keysounds. '
+                                 'Charts sharing keysounds with previous runs will not decode them again. '
+                                 'Default: No cache.',
+                            type=str)
+
+    arg_parser.add_argument('--cache_size',
+                            action='store',
+                            default=2048,
+                            help='Size limit of keysound cache in MiB. '
+                                 'Least recently used keysounds are evicted past it. '
+                                 'Default: 2048.',
+                            type=int)
+
+    arg_parser.add_argument('--mix_engine',
+                            action='store',
+                            choices=sorted(OGGConverter.MIX_ENGINES),
+                            default='layered',
+                            help='How keysounds are mixed into the audio file. '
+                                 'layered mixes non-overlapping layers one at a time. '
+                                 'numpy adds every sound once and clips only at the end, requires numpy. '
+                                 'stream is numpy mixing a few seconds at a time straight into the encoder, '
+                                 'so memory used does not grow with song length. '
+                                 'Default: layered.')
+
+    arg_parser.add_argument('--validation',
+                            action='store',
+                            choices=VALIDATION_LEVELS,
+                            default=get_validation_level(),
+                            help='strict checks every value while converting and explains what is wrong with it. '
+                                 'trusted skips all checks, which is a lot faster, '
+                                 'but invalid charts may fail with obscure errors or be converted incorrectly. '
+                                 'Default: strict, unless set by BM2SM_VALIDATION environment variable.')
+
+    arg_parser.add_argument('--profile',
+                            action='store',
+                            default=None,
+                            help='Write wall and CPU time of every conversion stage, as well as counters '
+                                 'of casts, time lookups and decoded samples, into this JSON file. '
+                                 'Batch mode can only be profiled with -J 1. Default: No profiling.',
+                            type=str)
+
+    arg_parser.add_argument('--profile_memory',
+                            action='store_true',
+                            default=False,
+                            help='Also record peak memory allocated by every stage in --profile. '
+                                 'Slows conversion down a lot. '
+                                 'Before Python 3.9 peaks cannot be reset, so a stage gets the highest peak so far.')
+
+    arg_parser.add_argument('--profile_cprofile',
+                            action='store_true',
+                            default=False,
+                            help='Also record functions taking the most time in every stage in --profile.')
 
     args = arg_parser.parse_args()
 
+    if args.incremental and not args.batch:
+        arg_parser.error('--incremental only works in batch mode')
+
+    if (args.profile_memory or args.profile_cprofile) and not args.profile:
+        arg_parser.error('--profile_memory and --profile_cprofile need --profile')
+
+    if args.profile and args.batch and (args.jobs > 1 or args.encode_jobs > 0):
+        arg_parser.error('--profile only covers this process, use -J 1 without --encode_jobs to profile batch mode')
+
+    if args.encode_queue < 1:
+        arg_parser.error('--encode_queue must be at least 1')
+
+    if args.progress is None:
+        args.progress = 'terminal' if args.verbose else 'none'
+
+    if args.decode_jobs is None:
+        args.decode_jobs = 1 if args.batch else cpu_count() or 1
+
+    options = {
+        'mix_engine': args.mix_engine,
+        'decode_jobs': args.decode_jobs
+    }
+    if args.cache_dir:
+        options['sample_cache'] = SampleCache(args.cache_dir, args.cache_size * 2 ** 20)
+
     if args.out_dir and not path.exists(args.out_dir):
         makedirs(args.out_dir)
 
-    if not args.verbose:
-        sys.stdout = StringIO()  # Null file
-        sys.stderr = StringIO()  # Another one for progress bars
+    if args.profile:
+        profiler = enable_profiling(args.profile_memory, args.profile_cprofile)
+        # Written on every exit, failed conversions are worth profiling too
+        atexit.register(profiler.dump, args.profile)
 
-    if not args.out_dir:
-        args.out_dir = path.split(args.in_file)[0]
+    charts = bm2sm.batch.collect_charts(args.batch) if args.batch else [args.in_file] if args.in_file else None
 
-    parser = bm2sm.BM_parser.BMChartParser(args.in_file, args.out_dir, args.keys, args.mode != 'SM')
+    if args.progress == 'none':
+        set_sink(NullSink())
+    elif args.progress == 'terminal':
+        set_sink(TerminalSink())
+    elif args.progress == 'aggregate':
+        aggregate_sink = AggregateSink(len(charts) if charts else None)
+        atexit.register(aggregate_sink.close)
+        set_sink(aggregate_sink)
+    else:
+        progress_file = sys.stderr
+        if args.progress_file:
+            progress_file = open(args.progress_file, 'w', encoding='utf-8')
+            atexit.register(progress_file.close)
+        set_sink(JsonLinesSink(progress_file))
 
-    if args.mode != 'AUDIO':
-        parser.SM_converter.compose_chart()
+    if args.batch:
+        manifest = None
+        if args.incremental:
+            manifest = Manifest(args.manifest or path.join(args.out_dir or '.', 'bm2sm_manifest.sqlite3'))
+        summary = bm2sm.batch.run_batch(charts, args.out_dir, args.keys, args.mode, args.jobs,
+                                        args.progress == 'terminal', manifest=manifest,
+                                        encode_jobs=args.encode_jobs, encode_queue=args.encode_queue, **options)
+        sys.exit(int(any(error_name is not None for _, error_name, _ in summary)))
 
-    if args.mode != 'SM':
-        parser.OGG_converter.bake_audio()
+    if args.folder:
+        parsers, failures = bm2sm.batch.convert_song(args.folder, args.out_dir, args.keys, args.mode, **options)
+        for parser in parsers:
+            get_sink().chart_finished(parser.BM_file_path)
+        for chart, error_name, message in failures:
+            print(bm2sm.batch.failure_line(chart, error_name, message))
+            get_sink().chart_finished(chart, error_name, message)
+        sys.exit(int(len(failures) > 0))
+
+    if not args.out_dir:
+        args.out_dir = path.split(args.in_file)[0]
 
-    parser.copy_files()
+    bm2sm.batch.convert_chart(args.in_file, args.out_dir, args.keys, args.mode, **options)
+    get_sink().chart_finished(args.in_file)
@@ -0,0 +1,199 @@
+# coding: utf-8
+
+# Conversion service that stays running between conversions, and a client to talk to it
+
+
+import sys
+import time
+from argparse import ArgumentParser
+from os import cpu_count, path
+
+from modules.validation import VALIDATION_LEVELS, get_validation_level, set_validation_level
+
+# Validation level decides how functions are decorated, so it must be set before anything else is imported
+validation_parser = ArgumentParser(add_help=False)
+validation_parser.add_argument('--validation', choices=VALIDATION_LEVELS)
+validation_level = validation_parser.parse_known_args()[0].validation
+if validation_level:
+    set_validation_level(validation_level)
+
+from bm2sm.OGG_converter import OGGConverter
+from bm2sm.batch import failure_line
+from bm2sm.daemon import ConversionDaemon, DEFAULT_HOST, DEFAULT_PORT, MODES, request, serve
+
+
+def run_serve(args):
+    conversion_daemon = ConversionDaemon(args.jobs, args.mix_engine, args.memory_size * 2 ** 20, args.decode_jobs)
+    print('Listening on {}:{}'.format(args.host, args.port))
+    sys.stdout.flush()
+    serve(conversion_daemon, args.host, args.port, args.verbose)
+
+
+def run_submit(args):
+    job_ids = []
+    for chart in args.charts:
+        reply = request('POST', '/jobs', {
+            'chart': path.abspath(chart),
+            'out_dir': path.abspath(args.out_dir) if args.out_dir else None,
+            'keys': args.keys,
+            'mode': args.mode,
+            'mix_engine': args.mix_engine
+        }, args.host, args.port)
+        job_ids.append(reply['id'])
+        if not args.wait:
+            print('{}    {}'.format(reply['id'], chart))
+
+    if not args.wait:
+        return 0
+
+    failed = 0
+    for job_id in job_ids:
+        while True:
+            job = request('GET', '/jobs/{}'.format(job_id), host=args.host, port=args.port)
+            if job['state'] in ('done', 'failed'):
+                break
+            time.sleep(args.poll_interval)
+        if job['state'] == 'done':
+            print('OK    {}'.format(job['chart']))
+        else:
+            failed += 1
+            print(failure_line(job['chart'], job['error'], job['message']))
+    return int(failed > 0)
+
+
+def run_job(args):
+    job = request('GET', '/jobs/{}'.format(args.id), host=args.host, port=args.port)
+    for key, value in job.items():
+        print('{:>10}: {}'.format(key, value))
+    return 0
+
+
+def run_status(args):
+    status = request('GET', '/status', host=args.host, port=args.port)
+    for key, value in status.items():
+        if isinstance(value, dict):
+            for inner_key, inner_value in value.items():
+                print('{:>24}: {}'.format('{} {}'.format(key, inner_key), inner_value))
+        else:
+            print('{:>24}: {}'.format(key, value))
+    return 0
+
+
+def run_stop(args):
+    request('POST', '/shutdown', {}, args.host, args.port)
+    return 0
+
+
+if __name__ == '__main__':
+    arg_parser = ArgumentParser(description='Keep converting BM files to SM without starting over for every chart')
+    arg_parser.add_argument('--host',
+                            action='store',
+                            default=DEFAULT_HOST,
+                            help='Address the service listens on. Default: {}, so it is only reachable locally.'.format(
+                                DEFAULT_HOST),
+                            type=str)
+    arg_parser.add_argument('--port',
+                            action='store',
+                            default=DEFAULT_PORT,
+                            help='Default: {}.'.format(DEFAULT_PORT),
+                            type=int)
+    commands = arg_parser.add_subparsers(dest='command')
+
+    serve_parser = commands.add_parser('serve',
+                                       help='Run the service until it is stopped.')
+    serve_parser.set_defaults(run=run_serve)
+    serve_parser.add_argument('-J', '--jobs',
+                              action='store',
+                              default=cpu_count() or 1,
+                              help='How many charts are converted at once. Workers prefer charts of the song '
+                                   'they have converted last, since they share samples. Default: Amount of CPU cores.',
+                              type=int)
+    serve_parser.add_argument('--decode_jobs',
+                              action='store',
+                              default=1,
+                              help='How many keysounds of a chart are decoded at once. Default: 1.',
+                              type=int)
+    serve_parser.add_argument('--memory_size',
+                              action='store',
+                              default=512,
+                              help='How many MiB of decoded keysounds every worker keeps between charts. '
+                                   'Least recently used keysounds are forgotten past it. Default: 512.',
+                              type=int)
+    serve_parser.add_argument('--mix_engine',
+                              action='store',
+                              choices=sorted(OGGConverter.MIX_ENGINES),
+                              default='layered',
+                              help='Mix engine of jobs that do not choose one. Default: layered.')
+    serve_parser.add_argument('--validation',
+                              action='store',
+                              choices=VALIDATION_LEVELS,
+                              default=get_validation_level(),
+                              help='Same as for the converter. Default: strict, '
+                                   'unless set by BM2SM_VALIDATION environment variable.')
+    serve_parser.add_argument('-V', '--verbose',
+                              action='store_true',
+                              default=False,
+                              help='Log every request.')
+
+    submit_parser = commands.add_parser('submit',
+                                        help='Queue conversion of charts and print ids of their jobs.')
+    submit_parser.set_defaults(run=run_submit)
+    submit_parser.add_argument('charts',
+                               help='Paths to charts to be converted.',
+                               nargs='+')
+    submit_parser.add_argument('-O', '--out_dir',
+                               action='store',
+                               default=None,
+                               help='Where to write converted files. Default: Same directory as the chart.',
+                               type=str)
+    submit_parser.add_argument('-K', '--keys',
+                               action='store',
+                               default='S1234567',
+                               help='Same as for the converter. Default: S1234567',
+                               type=str)
+    submit_parser.add_argument('-M', '--mode',
+                               action='store',
+                               choices=MODES,
+                               default='ALL',
+                               help='Same as for the converter. Default: ALL.')
+    submit_parser.add_argument('--mix_engine',
+                               action='store',
+                               choices=sorted(OGGConverter.MIX_ENGINES),
+                               default=None,
+                               help='Default: Whatever the service has been started with.')
+    submit_parser.add_argument('-W', '--wait',
+                               action='store_true',
+                               default=False,
+                               help='Wait until all charts are converted and print how each of them went.')
+    submit_parser.add_argument('--poll_interval',
+                               action='store',
+                               default=0.2,
+                               help='How many seconds to wait between asking about jobs with --wait. Default: 0.2.',
+                               type=float)
+
+    job_parser = commands.add_parser('job',
+                                     help='Print state of a job.')
+    job_parser.set_defaults(run=run_job)
+    job_parser.add_argument('id',
+                            type=int)
+
+    status_parser = commands.add_parser('status',
+                                        help='Print queue depth, throughput and hit rate of keysounds kept in memory.')
+    status_parser.set_defaults(run=run_status)
+
+    stop_parser = commands.add_parser('stop',
+                                      help='Stop the service once charts queued so far are converted.')
+    stop_parser.set_defaults(run=run_stop)
+
+    args = arg_parser.parse_args()
+    if args.command is None:
+        arg_parser.error('a command is required')
+
+    try:
+        sys.exit(args.run(args))
+    except (ConnectionError, OSError) as E:
+        if args.command == 'serve':
+            raise
+        arg_parser.exit(1, 'Cannot reach the service at {}:{}: {}\n'.format(args.host, args.port, E))
+    except ValueError as E:
+        arg_parser.exit(1, '{}\n'.format(E))
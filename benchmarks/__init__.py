@@ -0,0 +1 @@
+"""Benchmarks for the converter, run them as modules, e.g. `python -m benchmarks.bench_lnobj`."""
@@ -0,0 +1,64 @@
+"""Pairing of LNOBJ hold ends with their starts.
+
+Compares parsing an LNOBJ-heavy chart with how long the previous pairing alone would take on the same chart,
+which filtered and sorted all objects on every hold end.
+"""
+
+import operator
+import time
+from argparse import ArgumentParser
+from os import path
+from tempfile import TemporaryDirectory
+
+from benchmarks.chart_generator import write_chart
+from bm2sm.BM_parser import BMChartParser
+from bm2sm.definitions import Representations
+from bm2sm.progress import NullSink, set_sink
+
+
+def legacy_pairing(objects):
+    """Replay what pairing used to cost: every hold end searched all objects added before it."""
+    added = []
+    for obj in objects:
+        if obj.symbol == Representations.LN_END:
+            sorted((T
+                    for T in added
+                    if T.key == obj.key
+                    if T.symbol in (Representations.TAP, Representations.LN_START)),
+                   key=operator.attrgetter('position'))[-1]
+        added.append(obj)
+
+
+def run(notes_counts, legacy_limit):
+    set_sink(NullSink())  # Progress bars are not something to measure
+    print('{:>8} {:>12} {:>12}'.format('notes', 'parse, s', 'legacy, s'))
+    with TemporaryDirectory() as temp_dir:
+        for notes in notes_counts:
+            chart_path = path.join(temp_dir, 'ln_{}.bms'.format(notes))
+            write_chart(chart_path, notes, ln_obj=True)
+
+            start = time.perf_counter()
+            parser = BMChartParser(chart_path, temp_dir, 'S1234567', False)
+            parse_time = time.perf_counter() - start
+
+            legacy_time = float('nan')
+            if notes <= legacy_limit:
+                start = time.perf_counter()
+                legacy_pairing(parser.SM_converter.objects)
+                legacy_time = time.perf_counter() - start
+
+            print('{:>8} {:>12.3f} {:>12.3f}'.format(len(parser.SM_converter.objects), parse_time, legacy_time))
+
+
+if __name__ == '__main__':
+    arg_parser = ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--notes',
+                            default=[1000, 4000, 16000, 64000],
+                            nargs='+',
+                            type=int)
+    arg_parser.add_argument('--legacy_limit',
+                            default=16000,
+                            help='Legacy pairing is quadratic, so it is skipped for charts larger than this.',
+                            type=int)
+    args = arg_parser.parse_args()
+    run(args.notes, args.legacy_limit)
@@ -0,0 +1,81 @@
+"""Memory taken by each of the objects a chart is made of, next to the same objects keeping a __dict__."""
+
+import tracemalloc
+from argparse import ArgumentParser
+from fractions import Fraction
+
+from pydub import AudioSegment
+
+from bm2sm.data_structures import Datum, NotefieldObject, Sound, SoundSample
+from bm2sm.definitions import CHART_POSITION_SPLIT, DEFAULT_FRAME_RATE, Keys, Representations
+
+
+def _make_datum(i):
+    return Datum('01', i // 16, i % 16, 16, CHART_POSITION_SPLIT)
+
+
+def _make_notefield_object(i):
+    return NotefieldObject(i * CHART_POSITION_SPLIT // 16, Keys.KEY_1, Representations.TAP)
+
+
+def _make_sound(i, segment=AudioSegment.silent(duration=10, frame_rate=DEFAULT_FRAME_RATE)):
+    return Sound('01', segment, Fraction(i, 100))
+
+
+def _make_sound_sample(i):
+    return SoundSample('sample_{}.wav'.format(i))
+
+
+FACTORIES = (
+    ('Datum', _make_datum),
+    ('NotefieldObject', _make_notefield_object),
+    ('Sound', _make_sound),
+    ('SoundSample', _make_sound_sample),
+)
+
+
+def _dict_backed(name, factory):
+    """Wrap `factory` to make objects with the same attributes in a per-instance __dict__ instead of slots.
+
+    That's what the classes took before they had __slots__."""
+    dict_backed_class = type(name, (object,), {})
+
+    def make(i):
+        original = factory(i)
+        made = dict_backed_class()
+        for cls in type(original).__mro__:
+            for slot in getattr(cls, '__slots__', ()):
+                if hasattr(original, slot):
+                    setattr(made, slot, getattr(original, slot))
+        return made
+
+    return make
+
+
+def measure(factory, amount):
+    """Return average amount of bytes allocated for one object made by `factory`."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [factory(i) for i in range(amount)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # The list holding them is not part of the objects
+    list_size = 8 * len(objects)
+    return (after - before - list_size) / amount
+
+
+def run(amount):
+    print('{:>16} {:>14} {:>14}'.format('class', '__dict__', '__slots__'))
+    for name, factory in FACTORIES:
+        print('{:>16} {:>14.1f} {:>14.1f}'.format(name,
+                                                  measure(_dict_backed(name, factory), amount),
+                                                  measure(factory, amount)))
+
+
+if __name__ == '__main__':
+    arg_parser = ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--amount',
+                            default=20000,
+                            help='How many objects of each class are made.',
+                            type=int)
+    run(arg_parser.parse_args().amount)
@@ -0,0 +1,173 @@
+"""Time and peak memory of every stage of converting synthetic charts of growing size.
+
+Every chart is converted twice: once to measure time, and once with tracemalloc on to measure memory,
+since tracing allocations slows Python down considerably.
+Peak memory of a stage is the most memory allocated during it on top of what was allocated before it.
+Processing dynamic data includes fixing timing and looking up times of sounds, both are also measured on their own.
+Audio is only encoded if ffmpeg is found, otherwise mixing alone is measured.
+"""
+
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from collections import OrderedDict
+from contextlib import contextmanager
+from tempfile import TemporaryDirectory
+
+from pydub.utils import which
+
+from benchmarks.chart_generator import write_song
+from bm2sm.BM_parser import BMChartParser
+from bm2sm.OGG_converter import OGGConverter
+from bm2sm.progress import NullSink, set_sink
+
+STAGES = ('static reading', 'static data', 'dynamic data', 'timing fix', 'position to time',
+          'compose chart', 'bake audio')
+
+
+class StageMeter(object):
+    """Collects how long every stage took, and how much memory it needed if `trace_memory` is set."""
+
+    def __init__(self, trace_memory):
+        self.trace_memory = trace_memory
+        self.times = OrderedDict()
+        self.peaks = OrderedDict()
+
+    @contextmanager
+    def stage(self, name):
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = time.perf_counter() - start
+            if self.trace_memory:
+                self.peaks[name] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+
+def make_parser_class(meter):
+    """Parser class measuring its own stages with `meter`."""
+
+    class MeasuredParser(BMChartParser):
+        def _perform_static_reading(self):
+            with meter.stage('static reading'):
+                super()._perform_static_reading()
+
+        def _process_static_data(self):
+            with meter.stage('static data'):
+                super()._process_static_data()
+
+        def _process_dynamic_data(self):
+            with meter.stage('dynamic data'):
+                super()._process_dynamic_data()
+
+    return MeasuredParser
+
+
+def measure_chart(chart_path, out_dir, engine, encoder_found, trace_memory):
+    meter = StageMeter(trace_memory)
+    parser = make_parser_class(meter)(chart_path, out_dir, 'S1234567', True)
+
+    # Both are a part of processing dynamic data, so they are measured again on their own
+    timing_manager = parser.timing_manager
+    with meter.stage('timing fix'):
+        timing_manager.fix()  # Also forgets times that were already looked up
+
+    positions = [T[2].global_position for T in parser._dynamic_data]
+    position_to_time = timing_manager.position_to_time
+    with meter.stage('position to time'):
+        for position in positions:
+            position_to_time(position)
+
+    with meter.stage('compose chart'):
+        parser.SM_converter.compose_chart()
+
+    with meter.stage('bake audio'):
+        if encoder_found:
+            parser.OGG_converter.bake_audio(engine)
+        else:
+            converter = parser.OGG_converter
+            mixer = getattr(converter, OGGConverter.MIX_ENGINES[engine])
+            for _ in mixer(converter.get_song_length_in_frames(), 2, 2):
+                pass  # Streaming engines only mix when consumed
+
+    return len(parser.SM_converter.objects), len(parser.OGG_converter.sounds), meter
+
+
+def run(notes_counts, engine, memory, chart_options):
+    set_sink(NullSink())  # Progress bars are not something to measure
+    encoder_found = which('ffmpeg') is not None or which('avconv') is not None
+    if not encoder_found:
+        print('ffmpeg not found, bake audio only measures mixing')
+
+    print('{:>8} {:>8} {:>18} {:>10} {:>12}'.format('notes', 'sounds', 'stage', 'time, s', 'peak, MiB'))
+    with TemporaryDirectory() as temp_dir:
+        for notes in notes_counts:
+            chart_path = write_song(temp_dir, notes, **chart_options)
+            objects, sounds, meter = measure_chart(chart_path, temp_dir, engine, encoder_found, False)
+            # Holds of LNTYPE 2 are ended by 00 cells, which are never parsed, so only tap lanes count
+            expected = notes // 2 if chart_options.get('ln_type') == 2 else notes
+            assert objects >= expected * 0.9, 'Chart of {} notes only has {} of them parsed'.format(notes, objects)
+            if memory:
+                _, _, memory_meter = measure_chart(chart_path, temp_dir, engine, encoder_found, True)
+                peaks = memory_meter.peaks
+            else:
+                peaks = {}
+
+            for stage in STAGES:
+                peak = peaks.get(stage)
+                print('{:>8} {:>8} {:>18} {:>10.3f} {:>12}'.format(
+                    objects,
+                    sounds,
+                    stage,
+                    meter.times.get(stage, 0),
+                    '-' if peak is None else '{:.1f}'.format(peak / 2 ** 20)))
+
+
+if __name__ == '__main__':
+    arg_parser = ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--notes',
+                            default=[1000, 10000, 100000],
+                            help='Sizes of charts, 1000000 works too but takes a while.',
+                            nargs='+',
+                            type=int)
+    arg_parser.add_argument('--mix_engine',
+                            choices=sorted(OGGConverter.MIX_ENGINES),
+                            default='layered')
+    arg_parser.add_argument('--no_memory',
+                            action='store_true',
+                            default=False,
+                            help='Only measure time, which halves how long benchmarks take.')
+    arg_parser.add_argument('--wav_count',
+                            default=64,
+                            type=int)
+    arg_parser.add_argument('--ln_type',
+                            choices=[1, 2],
+                            default=None,
+                            type=int)
+    arg_parser.add_argument('--ln_obj',
+                            action='store_true',
+                            default=False)
+    arg_parser.add_argument('--bpm_density',
+                            default=0.1,
+                            type=float)
+    arg_parser.add_argument('--stop_density',
+                            default=0.05,
+                            type=float)
+    arg_parser.add_argument('--time_signature_density',
+                            default=0.05,
+                            type=float)
+    args = arg_parser.parse_args()
+    run(args.notes,
+        args.mix_engine,
+        not args.no_memory,
+        {
+            'wav_count': args.wav_count,
+            'ln_type': args.ln_type,
+            'ln_obj': args.ln_obj,
+            'bpm_density': args.bpm_density,
+            'stop_density': args.stop_density,
+            'time_signature_density': args.time_signature_density
+        })
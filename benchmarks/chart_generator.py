@@ -0,0 +1,152 @@
+"""Deterministic generator of synthetic BM charts and their keysounds."""
+
+import math
+import random
+import struct
+import wave
+from os import path
+
+# Channels of KEY1-KEY7 and SCRATCH
+KEY_CHANNELS = ('11', '12', '13', '14', '15', '18', '19', '16')
+# Channels of long notes of the same lanes
+LN_CHANNELS = ('51', '52', '53', '54', '55', '58', '59', '56')
+
+TIME_SIGNATURES = ('0.75', '0.5', '1.25', '1.5', '0.4375')
+STOP_DURATIONS = (12, 24, 48, 96)
+
+KEYSOUND_FRAME_RATE = 44100
+# Measures only have three digits
+MAX_MEASURE = 999
+
+
+def wav_id(number):
+    """Two character base 36 id of the `number`-th #WAV, starting from 01."""
+    digits = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    assert 0 < number < 36 * 36
+    return digits[number // 36] + digits[number % 36]
+
+
+def keysound_name(number):
+    return 'key{:04d}.wav'.format(number)
+
+
+def _lane_cells(rng, rows_per_measure, ln_obj, wav_ids):
+    cells = []
+    for row in range(rows_per_measure):
+        if row % 2:
+            cells.append('00')
+        elif ln_obj and row % 4:
+            cells.append('ZZ')
+        elif rng.random() < 0.95 or ln_obj:
+            cells.append(wav_ids[0] if len(wav_ids) == 1 else rng.choice(wav_ids))
+        else:
+            cells.append('00')
+    return cells
+
+
+def _long_note_cells(rng, rows_per_measure, ln_type, wav_ids):
+    # Holds take up to 4 rows and always start and end within the measure
+    cells = ['00'] * rows_per_measure
+    for start in range(0, rows_per_measure - 3, 4):
+        value = wav_ids[0] if len(wav_ids) == 1 else rng.choice(wav_ids)
+        if ln_type == 1:
+            # Start and end are two objects
+            cells[start] = cells[start + 2] = value
+        else:
+            # MGQ: hold lasts as long as there are objects
+            cells[start] = cells[start + 1] = cells[start + 2] = value
+    return cells
+
+
+def generate_chart(notes, ln_obj=False, rows_per_measure=16, seed=0, ln_type=None, wav_count=1,
+                   bpm_density=0.0, stop_density=0.0, time_signature_density=0.0):
+    """Return text of a chart with roughly `notes` objects spread over all lanes.
+
+    Charts too long for MAX_MEASURE measures of `rows_per_measure` rows get more rows in each measure instead.
+    If `ln_obj` is set, every other object on a lane ends a hold started by the previous one using LNOBJ.
+    If `ln_type` is 1 or 2, half of the lanes have long notes of that LNTYPE instead of taps.
+    Objects play one of `wav_count` keysounds, see write_keysounds.
+    Densities are probabilities of a measure having a BPM change, a STOP or a time signature.
+    """
+    rng = random.Random(seed)
+    wav_ids = [wav_id(T) for T in range(1, wav_count + 1)]
+
+    lines = [
+        '#PLAYER 1',
+        '#TITLE Synthetic {} notes'.format(notes),
+        '#ARTIST benchmarks',
+        '#BPM 150',
+    ]
+    lines.extend('#WAV{} {}'.format(T, keysound_name(number))
+                 for number, T in enumerate(wav_ids, 1))
+    if ln_obj:
+        lines.append('#LNOBJ ZZ')
+    if ln_type:
+        lines.append('#LNTYPE {}'.format(ln_type))
+    if stop_density:
+        lines.extend('#STOP{:02d} {}'.format(number, T) for number, T in enumerate(STOP_DURATIONS, 1))
+
+    notes_per_measure = len(KEY_CHANNELS) * rows_per_measure // 2
+    measures = max(1, -(-notes // notes_per_measure))
+    if measures > MAX_MEASURE:
+        # Multiple of 4, so holds still fit in
+        rows_per_measure = 4 * -(-notes // (2 * len(KEY_CHANNELS) * MAX_MEASURE))
+        notes_per_measure = len(KEY_CHANNELS) * rows_per_measure // 2
+        measures = -(-notes // notes_per_measure)
+    for measure in range(1, measures + 1):
+        if time_signature_density and rng.random() < time_signature_density:
+            lines.append('#{:03d}02:{}'.format(measure, rng.choice(TIME_SIGNATURES)))
+        if bpm_density and rng.random() < bpm_density:
+            cells = ['00'] * 4
+            cells[rng.randrange(4)] = '{:02X}'.format(rng.randrange(60, 240))
+            lines.append('#{:03d}03:{}'.format(measure, ''.join(cells)))
+        if stop_density and rng.random() < stop_density:
+            cells = ['00'] * 4
+            cells[rng.randrange(4)] = '{:02d}'.format(rng.randrange(1, len(STOP_DURATIONS) + 1))
+            lines.append('#{:03d}09:{}'.format(measure, ''.join(cells)))
+
+        for lane, channel in enumerate(KEY_CHANNELS):
+            if ln_type and lane % 2:
+                cells = _long_note_cells(rng, rows_per_measure, ln_type, wav_ids)
+                channel = LN_CHANNELS[lane]
+            else:
+                cells = _lane_cells(rng, rows_per_measure, ln_obj, wav_ids)
+            lines.append('#{:03d}{}:{}'.format(measure, channel, ''.join(cells)))
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_chart(file_path, notes, **kwargs):
+    with open(file_path, 'w', encoding='utf-8') as out_file:
+        out_file.write(generate_chart(notes, **kwargs))
+
+
+def write_keysounds(directory, wav_count, duration_ms=100, seed=0):
+    """Write `wav_count` short 16 bit mono keysounds named by keysound_name into `directory`.
+
+    Odd ones are sines of different pitches, even ones are bursts of noise."""
+    rng = random.Random(seed)
+    frames = KEYSOUND_FRAME_RATE * duration_ms // 1000
+    for number in range(1, wav_count + 1):
+        if number % 2:
+            frequency = 110 * 2 ** (number % 48 / 12)
+            samples = [int(12000 * math.sin(2 * math.pi * frequency * T / KEYSOUND_FRAME_RATE))
+                       for T in range(frames)]
+        else:
+            samples = [rng.randint(-8000, 8000) for _ in range(frames)]
+        # Fade out so keysounds don't click
+        samples = [T * (frames - position) // frames for position, T in enumerate(samples)]
+
+        with wave.open(path.join(directory, keysound_name(number)), 'wb') as out_file:
+            out_file.setnchannels(1)
+            out_file.setsampwidth(2)
+            out_file.setframerate(KEYSOUND_FRAME_RATE)
+            out_file.writeframes(struct.pack('<{}h'.format(frames), *samples))
+
+
+def write_song(directory, notes, wav_count=16, **kwargs):
+    """Write a chart with `notes` objects and all of its keysounds into `directory`, return path of the chart."""
+    chart_path = path.join(directory, 'synthetic_{}.bms'.format(notes))
+    write_chart(chart_path, notes, wav_count=wav_count, **kwargs)
+    write_keysounds(directory, wav_count)
+    return chart_path
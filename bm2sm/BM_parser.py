@@ -1,30 +1,136 @@
 import operator
+from bisect import insort
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from fractions import Fraction
-from glob import glob, escape
+from functools import reduce
+from io import StringIO
+from itertools import count as iter_count
+from locale import getpreferredencoding
 from os import path
-from re import findall, match
 from shutil import copy2
 
-from chardet import detect as char_detect
+from chardet.universaldetector import UniversalDetector
 
+from bm2sm.BM_tokenizer import ChannelMessage, DEFINED_CHANNELS, HeaderMessage, StpMessage, \
+    TimeSignatureMessage, tokenize_line
 from bm2sm.OGG_converter import OGGConverter
 from bm2sm.SM_converter import SMChartConverter
-from bm2sm.custom_fake_types import BPM, Beat, MsStop, Segment
+from bm2sm.custom_fake_types import BPM, Beat, MsStop, Segment, discretize_ticks
 from bm2sm.data_structures import Datum, NotefieldObject, Sound, SoundSample
-from bm2sm.definitions import Keys, Representations, standard_tqdm
+from bm2sm.definitions import CHART_POSITION_SPLIT, Keys, Representations
 from bm2sm.exceptions import BPMIsNotDefined, FirstHoldHasNoStart, LNTypeUnsupportedError, NotPlayer1Error, \
     StopIsNotDefined, UndecidableAudioFile, UnsupportedControlFlowError
+from bm2sm.profiling import profiled, stage
+from bm2sm.progress import message, progress
+from bm2sm.song_index import song_index
 from bm2sm.timing_manager import TimingSectionManager
 from modules import null_func
-from modules.decorators import transform_args
+from modules.additional_functions import lcm
+from modules.decorators import coerce_args
 from modules.fake_types import CastableToInt, PositiveInt
-from modules.functions import base_16_to_dec, is_non_str_sequence
+from modules.functions import LRUCache, base_16_to_dec
+
+# noinspection SpellCheckingInspection
+_HEADER_HANDLERS = {
+    'PLAYER': '_assert_correct_player',
+    'TITLE': '_set_title',
+    'SUBTITLE': '_parse_implicit_subtitle',
+    'ARTIST': '_set_artist',
+    'BPM': '_set_initial_bpm',
+    'DIFFICULTY': '_set_difficulty',
+    'LNTYPE': '_set_ln_type',
+    'LNOBJ': '_add_ln_object',
+    'STAGEFILE': '_set_stagefile',
+    'BANNER': '_set_banner',
+    'END IF': '_puke_from_gimmicks',
+    'ELSE': '_puke_from_gimmicks',
+    'ENDRANDOM': '_puke_from_gimmicks',
+    'SKIP': '_puke_from_gimmicks',
+    'DEF': '_puke_from_gimmicks',
+    'ENDSW': '_puke_from_gimmicks',
+    'RANDOM': '_puke_from_gimmicks',
+    'IF': '_puke_from_gimmicks',
+    'RONDAM': '_puke_from_gimmicks',
+    'SETRANDOM': '_puke_from_gimmicks',
+    'ELSEIF': '_puke_from_gimmicks',
+    'SWITCH': '_puke_from_gimmicks',
+    'CASE': '_puke_from_gimmicks',
+}
+
+_HEXADECIMAL = frozenset('0123456789ABCDEF')
+_ALPHANUMERIC = frozenset('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+
+# Headers followed by a two character id, such as #WAV01, and characters their ids consist of
+_ID_HEADER_HANDLERS = {
+    'BPM': ('_define_extended_bpm', _HEXADECIMAL),
+    'EXBPM': ('_define_extended_bpm', _HEXADECIMAL),
+    'STOP': ('_define_stop', _ALPHANUMERIC),
+    'WAV': ('_define_wav', _ALPHANUMERIC)
+}
+
+
+# Sibling difficulties of a song nearly always share encoding, so it's only detected once per song directory
+_song_encodings = LRUCache(1024)
+_DETECTION_CHUNK_SIZE = 1 << 12
+
+
+def detect_encoding(raw_data):
+    """Detect encoding of `raw_data`, feeding it to chardet only until it is confident."""
+    detector = UniversalDetector()
+    for start in range(0, len(raw_data), _DETECTION_CHUNK_SIZE):
+        detector.feed(raw_data[start:start + _DETECTION_CHUNK_SIZE])
+        if detector.done:
+            break
+    return detector.close()['encoding']
+
+
+def _decode_lines(raw_data, encoding):
+    # Newlines are translated the same way reading a file in text mode does
+    return StringIO(raw_data.decode(encoding or getpreferredencoding(False)), newline=None).readlines()
+
+
+def decode_chart(raw_data, song_dir):
+    """Split `raw_data` of a chart from `song_dir` into lines of text.
+
+    Encoding detected for a previous chart of the same song is tried first,
+        unless `song_dir` is None for a chart that does not come from any directory."""
+    if song_dir is None:
+        return _decode_lines_with_detection(raw_data)[0]
+
+    song_dir = path.abspath(song_dir)
+    if song_dir in _song_encodings:
+        try:
+            return _decode_lines(raw_data, _song_encodings[song_dir])
+        except UnicodeDecodeError:
+            pass  # This one is special, detect it on its own
+
+    lines, _song_encodings[song_dir] = _decode_lines_with_detection(raw_data)
+    return lines
+
+
+def _decode_lines_with_detection(raw_data):
+    encoding = detect_encoding(raw_data)
+    try:
+        lines = _decode_lines(raw_data, encoding)
+    except UnicodeDecodeError:
+        # Almost certainly chardet failed to detect ShiftJIS
+        encoding = 'shift_jis'
+        lines = _decode_lines(raw_data, encoding)
+    return lines, encoding
 
 
 class BMChartParser(object):
-    """A class where all the heavy lifting of parsing BM files is happening."""
+    """A class where all the heavy lifting of parsing BM files is happening.
+
+    If `chart_data` is set, the chart is parsed from these bytes and `in_file` only names it.
+    If `resolve_sample` is set, it is called with every file name #WAV headers refer to
+        and returns contents of that file as bytes, or None if there is no such file.
+        Samples are then never looked for on disk.
+    """
 
-    def __init__(self, in_file, out_dir, keys, load_sounds):
+    def __init__(self, in_file, out_dir, keys, load_sounds, sample_cache=None, decode_jobs=1, samples=None,
+                 chart_data=None, resolve_sample=None):
         self._extended_BPM_definitions = {}
         self._extended_stop_definitions = {}
         self._wav_files_definitions = {}
@@ -32,6 +138,17 @@ class BMChartParser(object):
         self._LN_objects = set()
         self._LN_opened = {}
         self._LN_type = 1
+        # Taps on every lane ordered by position, the last one becomes a hold when LNOBJ ends on that lane
+        self._LN_tap_candidates = defaultdict(list)
+        self._LN_tap_counter = iter_count()
+
+        self._sample_cache = sample_cache
+        # Samples by their location, charts of the same song can share them to only decode each one once
+        self._samples = {} if samples is None else samples
+        self._decode_jobs = decode_jobs
+        self._song_index = None
+        self._chart_data = chart_data
+        self._resolve_sample = resolve_sample
 
         self.BM_file_name = path.splitext(path.basename(in_file))[0]
         self.BM_file_dir = path.dirname(in_file)
@@ -50,8 +167,15 @@ class BMChartParser(object):
         self._affected_files = set()
 
         self._dynamic_data = []
+        self._dynamic_messages = []
         self._static_data = []
 
+        # Every position in the chart has to be a whole number of ticks,
+        #   so a measure is split into the least common multiple of everything it can be split into.
+        #   Chart position grid and thousandths of STP are always there.
+        self._measure_splits = {CHART_POSITION_SPLIT, 1000}
+        self.ticks_per_measure = CHART_POSITION_SPLIT
+
         self.timing_manager = TimingSectionManager()
 
         self._add_object = self.SM_converter.objects.append
@@ -62,11 +186,14 @@ class BMChartParser(object):
         self._set_initial_bpm(130)
 
         # Some hooks
-        copying_needed = not path.samefile(self.BM_file_dir, self.SM_file_dir)
+        copying_needed = chart_data is None and not path.samefile(self.BM_file_dir, self.SM_file_dir)
         if not copying_needed:
             self.add_file_to_copy = null_func
             self.copy_files = null_func
 
+        if resolve_sample is not None:
+            self._define_wav = self._define_resolved_wav
+
         if not load_sounds:
             self._add_sound = null_func
             self._define_wav = null_func
@@ -79,7 +206,7 @@ class BMChartParser(object):
         try:
             bpm = base_16_to_dec(datum.value)
         except ValueError:
-            print('Invalid segment for BPM')
+            message('Invalid segment for BPM')
             raise
         self.timing_manager.add_bpm_change(datum.global_position, bpm)
 
@@ -94,31 +221,34 @@ class BMChartParser(object):
             raise BPMIsNotDefined(datum.value)
         self.timing_manager.add_bpm_change(datum.global_position, self._extended_BPM_definitions[datum.value])
 
-    @transform_args(..., Segment, **{
+    @coerce_args(..., Segment, **{
         '@1': 'This LNOBJ is invalid'
     })
     def _add_ln_object(self, value):
         self._LN_objects.add(value)
 
-    @transform_args(..., MsStop, PositiveInt, PositiveInt, **{
+    @coerce_args(..., MsStop, PositiveInt, PositiveInt, **{
         '@2': 'Invalid STP definition',
         '@3': 'Invalid STP definition'
     })
     def _add_ms_stop(self, duration, measure, measure_part):
         measure_part = Fraction(measure_part, 1000)
         beat = Beat(measure + measure_part)
-        self.timing_manager.add_ms_stop(beat, duration)
+        position = beat.numerator * self.ticks_per_measure // beat.denominator
+        self.timing_manager.add_ms_stop(position, duration)
 
     def _add_sound(self, datum: Datum):
         if datum.value not in self._wav_files_definitions:
             return
-        sound = self._wav_files_definitions[datum.value].segment
+        sample = self._wav_files_definitions[datum.value]
+        sound = sample.segment
         if not sound:
             return
         time = self.timing_manager.position_to_time(datum.global_position)
         self.OGG_converter.sounds.append(Sound(datum.value,
                                                sound,
-                                               time))
+                                               time,
+                                               sample.location))
 
     def _add_time_signature_change(self, datum_with_perks):
         measure = datum_with_perks.initial_measure
@@ -126,81 +256,115 @@ class BMChartParser(object):
 
         self.timing_manager.add_time_signature_change(measure, measure_length)
 
-    @transform_args(..., CastableToInt, **{
+    @coerce_args(..., CastableToInt, **{
         '@1': 'Cannot parse the expression of PLAYER'
     })
     def _assert_correct_player(self, player):
         if player != 1:
             raise NotPlayer1Error(player)
 
-    @transform_args(..., BPM, Segment, **{
+    @coerce_args(..., BPM, Segment, **{
         '@1': 'Invalid BPM definition'
     })
     def _define_extended_bpm(self, bpm, bpm_id):
         self._extended_BPM_definitions[bpm_id] = bpm
 
-    @transform_args(..., MsStop, Segment, **{
+    @coerce_args(..., MsStop, Segment, **{
         '@1': 'Invalid STOP definition'
     })
     def _define_stop(self, dur, stop_id):
         self._extended_stop_definitions[stop_id] = dur
 
-    @transform_args(..., ..., Segment)
+    @profiled('sample decoding')
+    def _decode_samples(self, channels):
+        # Samples are otherwise decoded one by one the first time a sound uses them,
+        #   so every sample that may be used is decoded at once beforehand
+        if self._decode_jobs <= 1:
+            return
+
+        samples = {
+            self._wav_files_definitions[datum.value]
+            for _, channel, datum in self._dynamic_data
+            if channel in channels and datum.value in self._wav_files_definitions
+        }
+        if len(samples) == 0:
+            return
+
+        with ThreadPoolExecutor(max_workers=self._decode_jobs) as executor:
+            decoded = executor.map(SoundSample.preload, samples)
+            with progress(iterable=decoded, desc='Decoding keysounds', total=len(samples)) as progress_decoded:
+                for _ in progress_decoded:
+                    pass
+
+    @coerce_args(..., ..., Segment)
     def _define_wav(self, value, wav_id):
-        header = path.dirname(self.BM_file_path)
+        if self._song_index is None:
+            self._song_index = song_index(self.BM_file_dir)
         filename = path.splitext(path.basename(value))[0]
-        file_path = escape(path.join(header, filename))
-        candidates = glob(file_path + '.*')
+        candidates = self._song_index.candidates(filename)
 
         if len(candidates) != 1:
             raise UndecidableAudioFile(value)
 
-        self._wav_files_definitions[wav_id] = SoundSample(candidates[0])
+        location = candidates[0]
+        if location not in self._samples:
+            self._samples[location] = SoundSample(location, self._sample_cache)
+        self._wav_files_definitions[wav_id] = self._samples[location]
+
+    @coerce_args(..., ..., Segment)
+    def _define_resolved_wav(self, value, wav_id):
+        # Samples that came from the resolver have no location, so they are known by their names
+        if value not in self._samples:
+            data = self._resolve_sample(value)
+            if data is None:
+                raise UndecidableAudioFile(value)
+            self._samples[value] = SoundSample(None, data=data)
+        self._wav_files_definitions[wav_id] = self._samples[value]
 
     def _feed_message(self, message):
-        channel_regex = r'\s*#(\d{3})(\w{2}):(\w{2,})\s*'
-        time_signature_regex = r'\s*#(\d{3})02:([\d\.]+)\s*'  # Because we are so special and unique, aren't we
-        header_regex = r'\s*#(\w+)\s+([^\n\r]+)\s*'
-        stp_regex = r'\s*#STP\s+(\d{3})\.(\d{3})\s+(\d+)\s*'  # Has a special syntax because why wouldn't it
-
-        defined_channels = ('01', '02', '03', '08', '09',
-                            '11', '12', '13', '14', '15', '16', '18', '19',
-                            '31', '32', '33', '34', '35', '36', '38', '39',
-                            '51', '52', '53', '54', '55', '56', '58', '59',
-                            'D1', 'D2', 'D3', 'D4', 'D5', 'D6', 'D8', 'D9')
-
-        if match(time_signature_regex, message):
-            measure, value = findall(time_signature_regex, message)[0]
-            measure = int(measure)
-            value = Fraction(value)
-
-            datum_with_perks = Datum('00', measure, 0, 192)
-            datum_with_perks.time_signature = value
-
-            self._dynamic_data.append((
-                measure,
-                '02',
-                datum_with_perks
-            ))
-
-        elif match(stp_regex, message):
-            measure, measure_part, duration = findall(stp_regex, message)[0]
-            self._static_data.append(('STP {}.{}'.format(measure, measure_part), duration))
+        token = tokenize_line(message)
+        if token is None:
+            return
+        token_type = type(token)
 
-        elif match(channel_regex, message):
-            measure, channel, data = findall(channel_regex, message)[0]
-            channel = channel.upper()
-            if channel not in defined_channels:
+        # Datums are only made once the whole chart is read and tick resolution is known
+        if token_type is ChannelMessage:
+            if token.channel not in DEFINED_CHANNELS:
                 return
-            measure = int(measure)
-            data = Datum.from_message(data, measure)
+            self._measure_splits.add(len(token.data) // 2)
+            self._dynamic_messages.append(token)
 
-            for datum in data:
-                self._dynamic_data.append((measure, channel, datum))
+        elif token_type is HeaderMessage:
+            self._static_data.append(token)
 
-        elif match(header_regex, message):
-            header, value = findall(header_regex, message)[0]
-            self._static_data.append((header, value))
+        elif token_type is TimeSignatureMessage:
+            measure, value = token
+            value = Fraction(value)
+            self._measure_splits.add(value.denominator)
+            self._dynamic_messages.append(TimeSignatureMessage(measure, value))
+
+        elif token_type is StpMessage:
+            self._static_data.append(token)
+
+    def _make_dynamic_data(self):
+        ticks_per_measure = self.ticks_per_measure
+        for token in self._dynamic_messages:
+            if type(token) is TimeSignatureMessage:
+                measure, value = token
+
+                datum_with_perks = Datum('00', measure, 0, CHART_POSITION_SPLIT, ticks_per_measure)
+                datum_with_perks.time_signature = value
+
+                self._dynamic_data.append((
+                    measure,
+                    '02',
+                    datum_with_perks
+                ))
+            else:
+                measure, channel, data = token
+                for datum in Datum.from_message(data, measure, ticks_per_measure):
+                    self._dynamic_data.append((measure, channel, datum))
+        self._dynamic_messages = []
 
     def _make_key_adder(self, key):
         # noinspection PyUnusedLocal
@@ -209,13 +373,10 @@ class BMChartParser(object):
             val = datum.value
             if val in self._LN_objects:
                 # LNOBJ stuff
-                if len(self.SM_converter.objects) == 0:
+                tap_candidates = self._LN_tap_candidates[key]
+                if len(tap_candidates) == 0:
                     raise FirstHoldHasNoStart
-                last_tap_note = sorted((T
-                                        for T in self.SM_converter.objects
-                                        if T.key == key
-                                        if T.symbol == Representations.TAP),
-                                       key=operator.attrgetter('position'))[-1]
+                last_tap_note = tap_candidates.pop()[-1]
                 last_tap_note.symbol = Representations.LN_START
                 new_object = NotefieldObject(datum.global_position,
                                              key,
@@ -224,6 +385,9 @@ class BMChartParser(object):
                 new_object = NotefieldObject(datum.global_position,
                                              key,
                                              Representations.TAP)
+                # Counter breaks ties the same way a stable sort would
+                insort(self._LN_tap_candidates[key],
+                       (new_object.position, next(self._LN_tap_counter), new_object))
                 self._add_sound(datum)
             self._add_object(new_object)
 
@@ -280,6 +444,7 @@ class BMChartParser(object):
     # The algorithm exploits presence of order for datums and time changes
     #   Which allows to create a concurrent environment as follows.
     # noinspection PyPropertyAccess
+    @profiled('row displacement')
     def _offset_dynamic_data(self):
         ordered_datums = sorted((T[2] for T in self._dynamic_data),
                                 key=operator.attrgetter('initial_measure'))
@@ -288,12 +453,16 @@ class BMChartParser(object):
         if len(ordered_time_sgn) == 0:
             return
 
+        ticks_per_measure = self.ticks_per_measure
+        grid = ticks_per_measure // CHART_POSITION_SPLIT
+
+        # All shifts are whole ticks since denominators of time signatures divide ticks_per_measure
         current_shift = 0
         new_shift = 0
         current_time_sgn = ordered_time_sgn.pop(0)
         changing_displacement = True
 
-        with standard_tqdm(iterable=ordered_datums, desc='Displacing rows') as progress_ordered_datum:
+        with progress(iterable=ordered_datums, desc='Displacing rows') as progress_ordered_datum:
             for datum in progress_ordered_datum:
                 displacement_measure, displacement_amount = current_time_sgn
 
@@ -304,23 +473,30 @@ class BMChartParser(object):
                         current_time_sgn = ordered_time_sgn.pop(0)
                         displacement_measure, displacement_amount = current_time_sgn
                         current_shift += new_shift
-                        new_shift = displacement_amount - 1
+                        new_shift = self._measure_shift(displacement_amount)
                         changing_displacement = False
 
                 if datum.initial_measure < displacement_measure:
                     changing_displacement = False
-                    datum.global_position += current_shift
+                    datum.global_position = discretize_ticks(datum.global_position + current_shift, 1, grid)
 
                 if datum.initial_measure == displacement_measure:
-                    local_position = datum.initial_position - datum.initial_measure
-                    new_local_position = local_position * displacement_amount
-                    displacement = new_local_position - local_position
-                    datum.global_position += displacement
-                    datum.global_position += current_shift
+                    local_position = datum.initial_position - datum.initial_measure * ticks_per_measure
+                    numerator, denominator = displacement_amount.numerator, displacement_amount.denominator
+                    # Position is displaced by local_position * (displacement_amount - 1) without leaving integers
+                    displaced_position = discretize_ticks(
+                        datum.global_position * denominator + local_position * (numerator - denominator),
+                        denominator,
+                        grid)
+                    datum.global_position = discretize_ticks(displaced_position + current_shift, 1, grid)
                     if not changing_displacement:
-                        new_shift = displacement_amount - 1
+                        new_shift = self._measure_shift(displacement_amount)
                         changing_displacement = True
 
+    def _measure_shift(self, measure_length):
+        return (measure_length.numerator - measure_length.denominator) * self.ticks_per_measure \
+            // measure_length.denominator
+
     def _parse_implicit_subtitle(self, subtitle):
         keywords_to_difficulty = {
             1: ("EASY", "BEGINNER", "LIGHT", "SIMPLE", "[B]", "(B)"),
@@ -339,13 +515,22 @@ class BMChartParser(object):
     def _puke_from_gimmicks(self, _=0):
         raise UnsupportedControlFlowError
 
-    @transform_args(..., BPM, **{
+    def _set_artist(self, value):
+        self.SM_converter.make_setter('artist')(value)
+
+    def _set_banner(self, value):
+        self.SM_converter.make_file_setter('banner')(value)
+
+    def _set_difficulty(self, value):
+        self.SM_converter.set_difficulty(value)
+
+    @coerce_args(..., BPM, **{
         '@1': 'Invalid initial BPM'
     })
     def _set_initial_bpm(self, value):
         self.timing_manager.add_bpm_change(0, value)
 
-    @transform_args(..., CastableToInt, **{
+    @coerce_args(..., CastableToInt, **{
         '@1': 'Invalid LNType'
     })
     def _set_ln_type(self, value):
@@ -353,13 +538,20 @@ class BMChartParser(object):
             raise LNTypeUnsupportedError(value)
         self._LN_type = value
 
+    def _set_stagefile(self, value):
+        self.SM_converter.make_file_setter('bg')(value)
+
+    def _set_title(self, value):
+        self.SM_converter.make_setter('title')(value)
+
+    @profiled('copy files')
     def copy_files(self):
         output_dir = path.dirname(self.SM_file_path)
 
         if len(self._affected_files) == 0:
             return
 
-        with standard_tqdm(iterable=self._affected_files, desc="Copying files into new directory") as progress_affected_files:
+        with progress(iterable=self._affected_files, desc="Copying files into new directory") as progress_affected_files:
             for file_path in progress_affected_files:
                 file_name = path.split(file_path)[1]
                 output_file = path.join(output_dir, file_name)
@@ -367,27 +559,30 @@ class BMChartParser(object):
                     return
                 copy2(file_path, output_file)
 
+    @profiled('static reading')
     def _perform_static_reading(self):
-        try:
-            with open(self.BM_file_path, 'rb') as in_file:
-                encoding = char_detect(in_file.read())['encoding']
-
+        if self._chart_data is not None:
+            data = decode_chart(self._chart_data, None)
+            self._chart_data = None  # Lines are all that's needed from now on
+        else:
             try:
-                with open(self.BM_file_path, 'r', encoding=encoding) as in_file:
-                    data = in_file.readlines()
-            except UnicodeDecodeError:
-                # Almost certainly chardet failed to detect ShiftJIS
-                with open(self.BM_file_path, 'r', encoding='shift_jis') as in_file:
-                    data = in_file.readlines()
-
-        except IOError:
-            print('Error occurred when opening BM chart')
-            raise
+                with open(self.BM_file_path, 'rb') as in_file:
+                    raw_data = in_file.read()
+            except IOError:
+                message('Error occurred when opening BM chart')
+                raise
 
-        with standard_tqdm(iterable=data, desc='Performing static reading') as progress_data:
+            data = decode_chart(raw_data, self.BM_file_dir)
+
+        with progress(iterable=data, desc='Performing static reading') as progress_data:
             for datum in progress_data:
                 self._feed_message(datum)
 
+        self.ticks_per_measure = reduce(lcm, self._measure_splits)
+        self.timing_manager.ticks_per_measure = self.ticks_per_measure
+        self._make_dynamic_data()
+
+    @profiled('dynamic data')
     def _process_dynamic_data(self):
         self._dynamic_data = sorted(self._dynamic_data, key=lambda v: v[0])
 
@@ -439,7 +634,7 @@ class BMChartParser(object):
             'D6': self._make_mine_adder(Keys.SCRATCH)
         }
 
-        def do_scan(simple_deciders, message):
+        def do_scan(simple_deciders, message, stage_name):
             amount = 0
             filtered = []
             for measure, channel, datum in self._dynamic_data:
@@ -449,70 +644,48 @@ class BMChartParser(object):
             if amount == 0:
                 return
 
-            with standard_tqdm(iterable=filtered, desc=message, total=amount) as progress_dynamic_data:
+            with stage(stage_name), \
+                    progress(iterable=filtered, desc=message, total=amount) as progress_dynamic_data:
                 for measure, channel, datum in progress_dynamic_data:
                     if channel in simple_deciders:
                         simple_deciders[channel](datum)
 
         # All of this is used to map beats to time on the notefield
-        do_scan(lengths, 'Processing time signature changes')
+        do_scan(lengths, 'Processing time signature changes', 'time signatures')
         self._offset_dynamic_data()
-        do_scan(slopes, 'Processing BPM changes')
-        do_scan(discontinuities, 'Processing stops')
+        do_scan(slopes, 'Processing BPM changes', 'BPM changes')
+        do_scan(discontinuities, 'Processing stops', 'stops')
         self.timing_manager.fix()
 
         # And then add objects to the notefield
-        do_scan(content, 'Parsing objects')
+        self._decode_samples(content)
+        do_scan(content, 'Parsing objects', 'objects')
 
-    # noinspection SpellCheckingInspection
+    @profiled('static data')
     def _process_static_data(self):
-        simple_deciders = {
-            'PLAYER': self._assert_correct_player,
-            'TITLE': self.SM_converter.make_setter('title'),
-            'SUBTITLE': self._parse_implicit_subtitle,
-            'ARTIST': self.SM_converter.make_setter('artist'),
-            'BPM': self._set_initial_bpm,
-            'DIFFICULTY': self.SM_converter.set_difficulty,
-            'LNTYPE': self._set_ln_type,
-            'LNOBJ': self._add_ln_object,
-            'STAGEFILE': self.SM_converter.make_file_setter('bg'),
-            'BANNER': self.SM_converter.make_file_setter('banner'),
-            'END IF': self._puke_from_gimmicks,
-            'ELSE': self._puke_from_gimmicks,
-            'ENDRANDOM': self._puke_from_gimmicks,
-            'SKIP': self._puke_from_gimmicks,
-            'DEF': self._puke_from_gimmicks,
-            'ENDSW': self._puke_from_gimmicks,
-            'RANDOM': self._puke_from_gimmicks,
-            'IF': self._puke_from_gimmicks,
-            'RONDAM': self._puke_from_gimmicks,
-            'SETRANDOM': self._puke_from_gimmicks,
-            'ELSEIF': self._puke_from_gimmicks,
-            'SWITCH': self._puke_from_gimmicks,
-            'CASE': self._puke_from_gimmicks,
-        }
-
-        advanced_deciders = {
-            r'STP (\d{3})\.(\d{3})': self._add_ms_stop,
-            r'BPM([0-9a-fA-F]{2})': self._define_extended_bpm,
-            r'EXBPM([0-9a-fA-F]{2})': self._define_extended_bpm,
-            r'STOP([0-9a-zA-Z]{2})': self._define_stop,
-            r'WAV([0-9a-zA-Z]{2})': self._define_wav
-        }
-
-        with standard_tqdm(iterable=self._static_data, desc='Processing static data') as progress_static_data:
-            for header, value in progress_static_data:
+        with progress(iterable=self._static_data, desc='Processing static data') as progress_static_data:
+            for token in progress_static_data:
+                if type(token) is StpMessage:
+                    measure, measure_part, duration = token
+                    self._add_ms_stop(duration, measure, measure_part)
+                    continue
+
+                header, value = token
                 header = header.upper()
-                if header in simple_deciders:
-                    simple_deciders[header](value)
-
-                for candidate in advanced_deciders:
-                    if match(candidate, header):
-                        additional_data = findall(candidate, header)[0]
-                        if is_non_str_sequence(additional_data):
-                            advanced_deciders[candidate](value, *additional_data)
-                        else:
-                            advanced_deciders[candidate](value, additional_data)
+                if header in _HEADER_HANDLERS:
+                    getattr(self, _HEADER_HANDLERS[header])(value)
+                    continue
+
+                header_name, header_id = header[:-2], header[-2:]
+                if header_name in _ID_HEADER_HANDLERS:
+                    handler_name, id_characters = _ID_HEADER_HANDLERS[header_name]
+                    if id_characters.issuperset(header_id):
+                        getattr(self, handler_name)(value, header_id)
+
+    @property
+    def sample_files(self):
+        """Locations of every sample the chart defines, samples from the resolver have none."""
+        return sorted({T.location for T in self._wav_files_definitions.values() if T.location is not None})
 
     def add_file_to_copy(self, file_path):
         file_path = (file_path
@@ -0,0 +1,61 @@
+"""Tokenizer for lines of BM files, usable by anything that only needs to scan them."""
+
+import re
+from collections import namedtuple
+
+ChannelMessage = namedtuple('ChannelMessage', ('measure', 'channel', 'data'))
+TimeSignatureMessage = namedtuple('TimeSignatureMessage', ('measure', 'value'))
+StpMessage = namedtuple('StpMessage', ('measure', 'measure_part', 'duration'))
+HeaderMessage = namedtuple('HeaderMessage', ('header', 'value'))
+
+DEFINED_CHANNELS = frozenset(('01', '02', '03', '08', '09',
+                              '11', '12', '13', '14', '15', '16', '18', '19',
+                              '31', '32', '33', '34', '35', '36', '38', '39',
+                              '51', '52', '53', '54', '55', '56', '58', '59',
+                              'D1', 'D2', 'D3', 'D4', 'D5', 'D6', 'D8', 'D9'))
+
+# Alternatives are tried in order, so a line is whatever the first one that matches says it is.
+_line_regex = re.compile(r"""
+    \s*\#(?:
+        # Because we are so special and unique, aren't we
+        (?P<time_signature_measure>\d{3})02:(?P<time_signature_value>[\d.]+)
+        # Has a special syntax because why wouldn't it
+        | STP\s+(?P<stp_measure>\d{3})\.(?P<stp_measure_part>\d{3})\s+(?P<stp_duration>\d+)
+        | (?P<channel_measure>\d{3})(?P<channel>\w{2}):(?P<channel_data>\w{2,})
+        | (?P<header>\w+)\s+(?P<header_value>[^\n\r]+)
+    )""", re.VERBOSE)
+
+
+def tokenize_line(line):
+    """Classify a single line of a BM file.
+
+    Returns one of ChannelMessage, TimeSignatureMessage, StpMessage and HeaderMessage,
+        or None if the line is not a command.
+    Measures of channel messages and time signatures are ints, channels are uppercase, everything else is str.
+    """
+    if '#' not in line:
+        return None
+
+    found = _line_regex.match(line)
+    if found is None:
+        return None
+
+    # Last group of every alternative tells which one has matched
+    kind = found.lastgroup
+    if kind == 'channel_data':
+        measure, channel, data = found.group('channel_measure', 'channel', 'channel_data')
+        return ChannelMessage(int(measure), channel.upper(), data)
+    if kind == 'header_value':
+        return HeaderMessage(*found.group('header', 'header_value'))
+    if kind == 'time_signature_value':
+        measure, value = found.group('time_signature_measure', 'time_signature_value')
+        return TimeSignatureMessage(int(measure), value)
+    return StpMessage(*found.group('stp_measure', 'stp_measure_part', 'stp_duration'))
+
+
+def tokenize(lines):
+    """Yield a record for every command in `lines`, see tokenize_line."""
+    for line in lines:
+        token = tokenize_line(line)
+        if token is not None:
+            yield token
@@ -1,13 +1,20 @@
+import hashlib
 import operator
 from audioop import add as audio_add
+from subprocess import DEVNULL, PIPE, Popen
+from tempfile import TemporaryFile
 from typing import List
 
 from pydub import AudioSegment
-from tqdm import tqdm
+from pydub.exceptions import CouldntEncodeError
+from pydub.utils import get_encoder_name
 
 from bm2sm.data_structures import Sound
-from bm2sm.definitions import DEFAULT_FRAME_RATE, standard_tqdm
+from bm2sm.definitions import CONVERTER_VERSION, DEFAULT_CHANNELS, DEFAULT_FRAME_RATE, DEFAULT_SAMPLE_WIDTH
 from bm2sm.exceptions import EmptyChart
+from bm2sm.profiling import stage
+from bm2sm.progress import message, progress
+from bm2sm.sample_cache import sample_digest
 from modules.decorators import transform_return
 from modules.fake_types import CastableToInt
 
@@ -15,6 +22,18 @@ from modules.fake_types import CastableToInt
 class OGGConverter(object):
     """A class where audio baking is done."""
 
+    MIX_ENGINES = {
+        'layered': '_mix_layered',
+        'numpy': '_mix_numpy',
+        'stream': '_mix_stream'
+    }
+    # These engines yield the track block by block instead of returning it whole
+    STREAMING_ENGINES = frozenset(('stream',))
+    # How many frames are mixed at once by streaming engines
+    STREAM_BLOCK_FRAMES = 2 ** 16
+    # These engines produce the same audio no matter what order sounds come in
+    ORDER_INDEPENDENT_ENGINES = frozenset(('numpy', 'stream'))
+
     parent = ...  # type: 'BMChartParser'
     sounds = ...  # type: List[Sound]
 
@@ -22,8 +41,60 @@ class OGGConverter(object):
         self.parent = parent
         self.sounds = []
 
+    def bake_audio(self, engine='layered'):
+        """Mix all sounds into a single track and write it into the OGG file.
+
+        `engine` is one of MIX_ENGINES, they only differ in how overflowing samples are clipped."""
+        if engine not in self.STREAMING_ENGINES:
+            self.export_audio(self.parent.OGG_file_path, engine)
+            return
+
+        mixer, song_length_in_frames, sample_width, channels = self._prepare_mixing(engine)
+        message('Streaming OGG file')
+        # Blocks are mixed as the encoder asks for them, so mixing is a part of exporting
+        with stage('export'):
+            self._encode_stream(mixer(song_length_in_frames, sample_width, channels), sample_width, channels)
+
+    def export_audio(self, out_file, engine='layered', audio_format='ogg'):
+        """Mix all sounds into a single track and write it in `audio_format` into `out_file`,
+        which is a path or a binary file object."""
+        output = self.mix(engine)
+
+        message('Writing OGG file')
+        with stage('export'):
+            output.export(out_file,
+                          format=audio_format)
+
+    def mix(self, engine='layered'):
+        """Mix all sounds into a single track and return it as a segment.
+
+        Blocks mixed by streaming engines are joined, so the whole track is held in memory either way."""
+        mixer, song_length_in_frames, sample_width, channels = self._prepare_mixing(engine)
+
+        with stage('mixing'):
+            result = mixer(song_length_in_frames, sample_width, channels)
+            if engine in self.STREAMING_ENGINES:
+                result = b''.join(result)
+
+        return AudioSegment(data=result,
+                            channels=channels,
+                            frame_rate=DEFAULT_FRAME_RATE,
+                            sample_width=sample_width)
+
+    def _prepare_mixing(self, engine):
+        if len(self.sounds) == 0:
+            raise EmptyChart
+
+        song_length_in_frames = self.get_song_length_in_frames()
+
+        common_sound = self.sounds[0].sound
+        sample_width = common_sound.sample_width
+        channels = common_sound.channels
+
+        return getattr(self, self.MIX_ENGINES[engine]), song_length_in_frames, sample_width, channels
+
     # The basic idea of this algorithm is as follows
-    #   0. Sync all sounds, create a silent track of certain length.
+    #   0. Create a silent track of certain length, all sounds are already in the same format.
     #   1. Sort all sounds, by duration and by starting time.
     #   2. Starting from a null track, add sounds in such a way
     #        so that different sounds never intersect and overlap as such
@@ -33,26 +104,16 @@ class OGGConverter(object):
     #
     # This does NOT allow sounds to be interrupted by another sound
     #   so tracks utilizing this effect won't sound the same.
-    def bake_audio(self):
-        if len(self.sounds) == 0:
-            raise EmptyChart
-        self.sync_everything()
-
-        song_length_in_frames = self.get_song_length_in_frames()
-
+    def _mix_layered(self, song_length_in_frames, sample_width, channels):
         # Do you like immutability, punk?
         #   No you don't. Fuck you.
-        common_sound = self.sounds[0].sound
-        sample_width = common_sound.sample_width
-        channels = common_sound.channels
-
         multiplier = sample_width * channels
         silence_datum = b'\0' * multiplier
 
         sounds_to_process = self.sounds
         result = silence_datum * song_length_in_frames
 
-        overall_progress = standard_tqdm(desc='Processing track #1', total=len(sounds_to_process))
+        overall_progress = progress(desc='Processing track #1', total=len(sounds_to_process))
         track_counter = 1
         while len(sounds_to_process):
             sounds_processed_this_time = 0
@@ -65,7 +126,7 @@ class OGGConverter(object):
 
             last_frame = 0
 
-            with standard_tqdm(iterable=sounds_to_process, leave=False) as progress_sounds_to_process:
+            with progress(iterable=sounds_to_process, leave=False) as progress_sounds_to_process:
                 for sound in progress_sounds_to_process:
                     start_frame = sound.start_time_frames
                     end_frame = sound.end_time_frames
@@ -90,30 +151,146 @@ class OGGConverter(object):
             overall_progress.update(sounds_processed_this_time)
 
         overall_progress.close()
-        tqdm.write('Writing OGG file')
-        output = AudioSegment(data=result,
-                              channels=channels,
-                              frame_rate=DEFAULT_FRAME_RATE,
-                              sample_width=sample_width)
+        return result
+
+    # Every sound is added exactly once into an accumulator that is wide enough to never overflow,
+    #   and the result is clipped back into sample range only once, at the very end.
+    # Unlike layered algorithm, clipping of a sample doesn't depend on the order sounds are mixed in.
+    def _mix_numpy(self, song_length_in_frames, sample_width, channels):
+        import numpy  # Optional dependency, only needed for this engine
+
+        sample_type = {
+            1: numpy.int8,
+            2: numpy.int16,
+            4: numpy.int32
+        }[sample_width]
+        accumulator_type = numpy.int64 if sample_width == 4 else numpy.int32
+
+        accumulator = numpy.zeros(song_length_in_frames * channels, dtype=accumulator_type)
+
+        with progress(iterable=self.sounds, desc='Mixing sounds') as progress_sounds:
+            for sound in progress_sounds:
+                samples = numpy.frombuffer(sound.sound.raw_data, dtype=sample_type)
+                start = sound.start_time_frames * channels
+                accumulator[start:start + len(samples)] += samples
+
+        limits = numpy.iinfo(sample_type)
+        numpy.clip(accumulator, limits.min, limits.max, out=accumulator)
+        return accumulator.astype(sample_type).tobytes()
+
+    # Same as numpy engine, but the track is mixed in blocks of STREAM_BLOCK_FRAMES frames,
+    #   and only sounds that are heard during the current block are looked at.
+    # Memory needed does not depend on length of the song, only on the block size and the sounds themselves.
+    def _mix_stream(self, song_length_in_frames, sample_width, channels):
+        import numpy  # Optional dependency, only needed for this engine
+
+        sample_type = {
+            1: numpy.int8,
+            2: numpy.int16,
+            4: numpy.int32
+        }[sample_width]
+        accumulator_type = numpy.int64 if sample_width == 4 else numpy.int32
+        limits = numpy.iinfo(sample_type)
+
+        pending_sounds = sorted(self.sounds, key=operator.attrgetter('start_time_frames'))
+        pending_sounds.reverse()  # So that the next sound to start can be popped from the end
+        active_sounds = []
+
+        block_frames = self.STREAM_BLOCK_FRAMES
+        with progress(range(0, song_length_in_frames, block_frames),
+                      desc='Mixing sounds in blocks') as progress_blocks:
+            for block_start in progress_blocks:
+                block_end = min(block_start + block_frames, song_length_in_frames)
+
+                while pending_sounds and pending_sounds[-1].start_time_frames < block_end:
+                    sound = pending_sounds.pop()
+                    active_sounds.append((sound.start_time_frames,
+                                          numpy.frombuffer(sound.sound.raw_data, dtype=sample_type)))
 
-        output.export(self.parent.OGG_file_path,
-                      format='ogg')
+                accumulator = numpy.zeros((block_end - block_start) * channels, dtype=accumulator_type)
+                still_active = []
+                for start_frame, samples in active_sounds:
+                    sound_end = start_frame + len(samples) // channels
+                    from_frame = max(start_frame, block_start)
+                    to_frame = min(sound_end, block_end)
+                    accumulator[(from_frame - block_start) * channels:(to_frame - block_start) * channels] += \
+                        samples[(from_frame - start_frame) * channels:(to_frame - start_frame) * channels]
+                    if sound_end > block_end:
+                        still_active.append((start_frame, samples))
+                active_sounds = still_active
+
+                numpy.clip(accumulator, limits.min, limits.max, out=accumulator)
+                yield accumulator.astype(sample_type).tobytes()
+
+    def _encode_stream(self, blocks, sample_width, channels):
+        """Feed raw PCM `blocks` into the encoder as they come, without ever holding the whole track."""
+        pcm_format = {
+            1: 's8',
+            2: 's16le',
+            4: 's32le'
+        }[sample_width]
+
+        command = [get_encoder_name(),
+                   '-y',
+                   '-loglevel', 'error',
+                   '-f', pcm_format,
+                   '-ar', str(DEFAULT_FRAME_RATE),
+                   '-ac', str(channels),
+                   '-i', 'pipe:0',
+                   # Pinned the same way pydub does for other engines, ffmpeg could pick another codec otherwise
+                   '-acodec', AudioSegment.DEFAULT_CODECS['ogg'],
+                   '-f', 'ogg',
+                   self.parent.OGG_file_path]
+
+        with TemporaryFile() as error_log:
+            encoder = Popen(command, stdin=PIPE, stdout=DEVNULL, stderr=error_log)
+            try:
+                for block in blocks:
+                    encoder.stdin.write(block)
+            except BrokenPipeError:
+                pass  # Encoder has died, its return code will tell why
+            finally:
+                try:
+                    encoder.stdin.close()
+                except BrokenPipeError:
+                    pass
+                return_code = encoder.wait()
+
+            if return_code != 0:
+                error_log.seek(0)
+                raise CouldntEncodeError('Encoding failed. ffmpeg/avlib returned error code: {}\n\n{}'.format(
+                    return_code,
+                    error_log.read().decode('utf-8', errors='ignore')))
+
+    def fingerprint(self, engine='layered'):
+        """Hash of everything audio baked by `engine` depends on, None if it cannot be told.
+
+        Samples are identified by their contents, so charts playing the same files at the same frames
+            have the same fingerprint wherever those files are."""
+        if any(T.location is None for T in self.sounds):
+            return None
+
+        timeline = [(T.start_time_frames, sample_digest(T.location)) for T in self.sounds]
+        if engine in self.ORDER_INDEPENDENT_ENGINES:
+            timeline.sort()
+
+        digest = hashlib.sha1('{}|{}|{}|{}|{}'.format(CONVERTER_VERSION,
+                                                      engine,
+                                                      DEFAULT_FRAME_RATE,
+                                                      DEFAULT_SAMPLE_WIDTH,
+                                                      DEFAULT_CHANNELS).encode('utf-8'))
+        for start_frame, sample_hash in timeline:
+            digest.update('|{}:{}'.format(start_frame, sample_hash).encode('utf-8'))
+        return digest.hexdigest()
+
+    def timeline(self):
+        """Start frames and segments of all sounds in the order they are played.
+
+        Charts with equal timelines are baked into the same audio, as long as they share their samples."""
+        return tuple(sorted((T.start_time_frames, id(T.sound)) for T in self.sounds))
 
     @transform_return(CastableToInt)
     def get_song_length_in_frames(self):
         last_sound = max(self.sounds,
                          key=operator.attrgetter('end_time_frames'))
         return last_sound.end_time_frames
-
-    # noinspection PyProtectedMember
-    def sync_everything(self):
-        data = [(T, T.sound) for T in self.sounds]
-        sound, segments = zip(*data)
-
-        # Regular syncing creates copies of the sound
-        #   And this is slow as hell
-        # So a small hack is used as a workaround
-        synced_segments = AudioSegment._sync(*segments)
-        result = zip(sound, synced_segments)
-        for sound, synced_segment in result:
-            sound.sound = synced_segment
@@ -1,20 +1,21 @@
 import operator
 from functools import partial
+from itertools import groupby
+from math import gcd
 from typing import Any, Dict, List
 
-from tqdm import tqdm
-
 from bm2sm.data_structures import NotefieldObject
-from bm2sm.definitions import Keys, Representations, standard_tqdm
+from bm2sm.definitions import Keys, Representations
 from bm2sm.exceptions import EmptyChart, UnknownDifficulty, UnsupportedGameMode
-from modules.additional_functions import lcm
-from modules.decorators import transform_args
-from modules.fake_types import CastableToInt, NonNegativeInt
+from bm2sm.profiling import profiled
+from bm2sm.progress import message, progress
+from modules.decorators import coerce_args
+from modules.fake_types import CastableToInt
 
 
 class SMChartConverter(object):
     """A class composing the SM chart."""
-    _SM_format = """#TITLE:{title};
+    _SM_header_format = """#TITLE:{title};
 #SUBTITLE:{subtitle};
 #ARTIST:{artist};
 #CREDIT:{credit};
@@ -26,10 +27,10 @@ class SMChartConverter(object):
 #CDTITLE:;
 #OFFSET:0.0000000;
 #BPMS:{BPM_changes};
-#STOPS:{stops};
-#NOTES:
+#STOPS:{stops};"""
+    _SM_notes_format = """#NOTES:
 {game_mode}:
-:
+{description}:
 {difficulty_name}:
 {difficulty}:
 0.000,0.000,0.000,0.000,0.000:
@@ -45,6 +46,7 @@ class SMChartConverter(object):
             'bg': '',
             'banner': '',
             'credit': '',
+            'description': '',
             'difficulty': 6,
             'difficulty_name': "Edit",
             'genre': '',
@@ -65,75 +67,102 @@ class SMChartConverter(object):
         ]
 
     def compose_chart(self):
-        if len(self.objects) == 0:
-            raise EmptyChart
-        self.objects.sort(key=operator.attrgetter('position'))
+        self.write_sm_file(self._parent.SM_file_path, self._parent.OGG_file_name, (self,))
 
-        measure_splits = {}
-
-        with standard_tqdm(iterable=self.objects, desc='Composing SM chart manifold') as progress_objects:
-            for obj in progress_objects:
-                measure = obj.measure
-                if measure not in measure_splits:
-                    measure_splits[measure] = 4
-                cur_split = measure_splits[measure]
-                measure_splits[measure] = lcm(cur_split, obj.position.denominator)
-
-        amount_of_measures = max(measure_splits) + 1
-        measures = []
-
-        with standard_tqdm(range(amount_of_measures), desc='Filling SM chart with 0') as progress_measures:
-            for measure_num in progress_measures:
-                length = measure_splits.get(NonNegativeInt(measure_num), 4)
-                measures.append(
-                    [
-                        [
-                            Representations.NOTHING
-                            for _ in range(len(self.keys))
-                        ]
-                        for _ in range(length)
-                    ]
-                )
-
-        with standard_tqdm(iterable=self.objects, desc='Injecting objects into SM chart') as progress_objects:
-            for obj in progress_objects:
-                measure_split = measure_splits[obj.measure]
-                local_position = obj.position.numerator % obj.position.denominator
-                scaled_position = local_position * (measure_split //
-                                                    obj.position.denominator)
-
-                if obj.key not in self.keys:
-                    continue
-                relative_position = self.keys.index(obj.key)
-                this_measure = measures[obj.measure]
-
-                this_measure[scaled_position][relative_position] = obj.symbol
-
-        row_template = "{}" * len(self.keys)
-        notes = "\n,\n".join(
-            "\n".join(
-                row_template.format(*row)
-                for row in measure
-            )
-            for measure in measures
-        )
-
-        audio_out_file = self._parent.OGG_file_name
-        result = self._SM_format.format(**{
+    def compose_header(self, audio_name):
+        """Compose everything the SM chart has before its notes, `audio_name` being the audio file it refers to."""
+        return self._SM_header_format.format(**{
             **self._meta_data,
             'BPM_changes': self._parent.timing_manager.bpm_string,
             'stops': self._parent.timing_manager.ms_stops_string,
-            'measures': notes,
-            'audio_name': audio_out_file
+            'audio_name': audio_name
         })
 
-        result = result.encode('utf-8', errors='ignore')
-        tqdm.write('Writing SM file')
+    def write_notes(self, out_file):
+        """Write NOTES block of the SM chart into text `out_file` row by row, as measures are composed.
+
+        Only rows that have objects on them are ever built, empty ones are all the same string."""
+        if len(self.objects) == 0:
+            raise EmptyChart
+        self.objects.sort(key=operator.attrgetter('position'))
+
+        ticks_per_measure = self._parent.ticks_per_measure
+        # Only leftmost lane is used for a key, same as list.index would find
+        lanes = {}
+        for lane, key in enumerate(self.keys):
+            lanes.setdefault(key, lane)
+        empty_row = Representations.NOTHING * len(self.keys)
+        empty_measure = '\n'.join([empty_row] * 4)
+
+        notes_prefix, notes_suffix = self._SM_notes_format.split('{measures}')
+        out_file.write(notes_prefix.format(**self._meta_data))
+
+        def measure_of(obj):
+            return obj.position // ticks_per_measure
+
+        written_measures = 0
+        with progress(total=len(self.objects), desc='Writing SM chart') as progress_objects:
+            for measure, measure_objects in groupby(self.objects, key=measure_of):
+                for _ in range(written_measures, measure):
+                    if written_measures:
+                        out_file.write('\n,\n')
+                    out_file.write(empty_measure)
+                    written_measures += 1
+
+                local_objects = [(obj.position - measure * ticks_per_measure, obj) for obj in measure_objects]
+
+                # Measure is split into as many rows as the least common multiple
+                #   of denominators of positions within it, and at least 4
+                measure_split = 4
+                for local_position, _ in local_objects:
+                    denominator = ticks_per_measure // gcd(local_position, ticks_per_measure)
+                    measure_split = measure_split * denominator // gcd(measure_split, denominator)
+
+                rows = {}
+                for local_position, obj in local_objects:
+                    lane = lanes.get(obj.key)
+                    if lane is None:
+                        continue
+                    row_number = local_position * measure_split // ticks_per_measure
+                    if row_number not in rows:
+                        rows[row_number] = list(empty_row)
+                    rows[row_number][lane] = obj.symbol
+
+                if written_measures:
+                    out_file.write('\n,\n')
+                for row_number in range(measure_split):
+                    if row_number:
+                        out_file.write('\n')
+                    out_file.write(''.join(rows[row_number]) if row_number in rows else empty_row)
+                written_measures += 1
+
+                progress_objects.update(len(local_objects))
+
+        out_file.write(notes_suffix)
+
+    @staticmethod
+    @profiled('compose chart')
+    def write_sm(out_file, audio_name, converters):
+        """Write SM chart with the header of the first of `converters` and a NOTES block of every one of them
+        into text `out_file`."""
+        out_file.write(converters[0].compose_header(audio_name))
+        for converter in converters:
+            out_file.write('\n')
+            converter.write_notes(out_file)
+
+    @staticmethod
+    def write_sm_file(file_path, audio_name, converters):
+        """Write SM file at `file_path`, see write_sm."""
+        if any(len(T.objects) == 0 for T in converters):
+            raise EmptyChart
+
+        message('Writing SM file')
         try:
-            with open(self._parent.SM_file_path, 'wb') as f:
-                f.write(result)
+            # Characters that cannot be encoded are dropped and newlines are written as they are
+            with open(file_path, 'w', encoding='utf-8', errors='ignore', newline='') as out_file:
+                SMChartConverter.write_sm(out_file, audio_name, converters)
         except IOError:
-            tqdm.write('Error while opening SM file')
+            message('Error while opening SM file')
             raise
 
     def make_file_setter(self, field):
@@ -149,7 +178,7 @@ class SMChartConverter(object):
         """Create a setter for a metadata `field`"""
         return partial(operator.setitem, self._meta_data, field)
 
-    @transform_args(..., CastableToInt)
+    @coerce_args(..., CastableToInt)
     def set_difficulty(self, difficulty):
         diff_names = (None, "Beginner", "Easy", 'Medium', 'Hard', 'Challenge')
         try:
@@ -0,0 +1,468 @@
+"""Conversion of whole BM libraries using a pool of worker processes."""
+
+import queue
+import sys
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from glob import glob
+from os import link, listdir, makedirs, path, remove, walk
+from shutil import copy2
+
+from bm2sm.BM_parser import BMChartParser
+from bm2sm.SM_converter import SMChartConverter
+from bm2sm.exceptions import ConversionError, EmptyChart
+from bm2sm.manifest import Manifest
+from bm2sm.progress import NullSink, get_sink, set_sink
+
+BM_EXTENSIONS = ('.bms', '.bme', '.bml')
+
+
+def is_bm_chart(file_path):
+    return path.splitext(file_path)[1].lower() in BM_EXTENSIONS
+
+
+def collect_charts(sources):
+    """Expand `sources` into a sorted list of BM charts.
+
+    Every source may be a directory (searched recursively), a glob, a single chart
+    or a file list prefixed with @ that has one source per line.
+    """
+    charts = set()
+    for source in sources:
+        if source.startswith('@'):
+            with open(source[1:], 'r', encoding='utf-8') as list_file:
+                listed = [line.strip() for line in list_file]
+            charts.update(collect_charts([T for T in listed if T and not T.startswith('#')]))
+        elif path.isdir(source):
+            for dir_path, _, file_names in walk(source):
+                charts.update(path.abspath(path.join(dir_path, T))
+                              for T in file_names
+                              if is_bm_chart(T))
+        elif path.isfile(source):
+            charts.add(path.abspath(source))
+        else:
+            charts.update(path.abspath(T)
+                          for T in glob(source, recursive=True)
+                          if path.isfile(T) and is_bm_chart(T))
+    return sorted(charts)
+
+
+def convert_chart(in_file, out_dir, keys, mode, mix_engine='layered', audio_index=None, **parser_options):
+    """Convert a single chart, this is what the converter does for -I.
+
+    If `audio_index` manifest is set, audio already baked for another chart playing the same sounds is reused.
+    `parser_options` are passed to BMChartParser as is."""
+    if out_dir and not path.exists(out_dir):
+        makedirs(out_dir, exist_ok=True)
+
+    parser = BMChartParser(in_file, out_dir, keys, mode != 'SM', **parser_options)
+
+    if mode != 'AUDIO':
+        parser.SM_converter.compose_chart()
+
+    if mode != 'SM':
+        bake_or_reuse_audio(parser, mix_engine, audio_index)
+
+    parser.copy_files()
+    return parser
+
+
+def render_chart(in_file, out_dir, keys, mode, mix_engine='layered', audio_index=None, **parser_options):
+    """Convert a single chart like convert_chart does, except that its audio is mixed but not encoded.
+
+    Returns the parser, the mixed track to be encoded into its OGG file and the fingerprint the OGG file is
+        to be recorded with in `audio_index` once it's encoded.
+    Track is None if there is nothing to encode, either because of `mode` or because audio has been reused."""
+    if out_dir and not path.exists(out_dir):
+        makedirs(out_dir, exist_ok=True)
+
+    parser = BMChartParser(in_file, out_dir, keys, mode != 'SM', **parser_options)
+
+    if mode != 'AUDIO':
+        parser.SM_converter.compose_chart()
+
+    track = fingerprint = None
+    if mode != 'SM':
+        reused, fingerprint = _reuse_audio(parser, mix_engine, audio_index)
+        if not reused:
+            track = parser.OGG_converter.mix(mix_engine)
+
+    parser.copy_files()
+    return parser, track, fingerprint
+
+
+def bake_or_reuse_audio(parser, mix_engine, audio_index=None):
+    reused, fingerprint = _reuse_audio(parser, mix_engine, audio_index)
+    if reused:
+        return
+    parser.OGG_converter.bake_audio(mix_engine)
+    if fingerprint is not None:
+        audio_index.record_audio(fingerprint, parser.OGG_file_path)
+
+
+def _reuse_audio(parser, mix_engine, audio_index):
+    """Link audio `audio_index` knows to be baked from the same sounds into the OGG file of `parser`.
+
+    Returns whether audio has been reused, and the fingerprint the audio is to be recorded with otherwise,
+        None if it's not to be recorded at all."""
+    fingerprint = parser.OGG_converter.fingerprint(mix_engine) if audio_index is not None else None
+    if fingerprint is None:
+        return False, None
+
+    baked_file = audio_index.find_audio(fingerprint)
+    if baked_file is None:
+        if path.exists(parser.OGG_file_path):
+            # Might be linked to audio of another chart, which must stay as it is
+            remove(parser.OGG_file_path)
+        return False, fingerprint
+    if path.abspath(baked_file) != path.abspath(parser.OGG_file_path):
+        link_or_copy(baked_file, parser.OGG_file_path)
+    return True, fingerprint
+
+
+def link_or_copy(source, destination):
+    """Make `destination` a hard link to `source`, or a copy of it where links cannot be made."""
+    if path.exists(destination):
+        remove(destination)
+    try:
+        link(source, destination)
+    except OSError:
+        copy2(source, destination)
+
+
+def convert_song(song_dir, out_dir, keys, mode, mix_engine='layered', **parser_options):
+    """Convert all charts in `song_dir` into a single SM file with a NOTES block for each of them.
+
+    Charts share the SM file only if their timing is the same and, unless audio is not baked,
+        if they play the same sounds at the same time, since the audio is then baked only once for all of them.
+    Every other group of such charts gets a SM file of its own, named after its first chart.
+    Charts that cannot be converted are left out of the SM files.
+    Returns a list of parsers of every converted chart and a list of (chart, error name, message) of every chart
+        that has failed, raises EmptyChart if there are no charts or none of them could be converted."""
+    if out_dir and not path.exists(out_dir):
+        makedirs(out_dir, exist_ok=True)
+
+    charts = sorted(T for T in listdir(song_dir)
+                    if is_bm_chart(T) and path.isfile(path.join(song_dir, T)))
+    if len(charts) == 0:
+        raise EmptyChart
+
+    samples = {}  # Shared by all charts, so each sample is decoded once
+    parsers = []
+    failures = []
+    for chart in charts:
+        chart_path = path.join(song_dir, chart)
+        try:
+            parsers.append(BMChartParser(chart_path, out_dir, keys, mode != 'SM', samples=samples, **parser_options))
+        except ConversionError as E:
+            failures.append((chart_path, type(E).__name__, str(E)))
+    if len(parsers) == 0:
+        raise EmptyChart
+
+    groups = OrderedDict()
+    for parser in parsers:
+        timing_manager = parser.timing_manager
+        timeline = parser.OGG_converter.timeline() if mode != 'SM' else None
+        groups.setdefault((timing_manager.bpm_string, timing_manager.ms_stops_string, timeline), []).append(parser)
+
+    song_name = path.basename(path.abspath(song_dir))
+    for group_number, group in enumerate(groups.values()):
+        leader = group[0]
+        group_name = song_name if group_number == 0 else leader.BM_file_name
+        leader.OGG_file_name = group_name + '.ogg'
+        leader.OGG_file_path = path.join(leader.OGG_file_dir, leader.OGG_file_name)
+        leader.SM_file_name = group_name + '.sm'
+        leader.SM_file_path = path.join(leader.SM_file_dir, leader.SM_file_name)
+
+        if mode != 'AUDIO':
+            for parser in group:
+                parser.SM_converter.make_setter('description')(parser.BM_file_name)
+            SMChartConverter.write_sm_file(leader.SM_file_path,
+                                           leader.OGG_file_name,
+                                           [T.SM_converter for T in group])
+
+        if mode != 'SM':
+            leader.OGG_converter.bake_audio(mix_engine)
+
+        for parser in group:
+            parser.copy_files()
+
+    return parsers, failures
+
+
+def output_files(parser, mode):
+    """Files `parser` has written in `mode`."""
+    outputs = []
+    if mode != 'AUDIO':
+        outputs.append(parser.SM_file_path)
+    if mode != 'SM':
+        outputs.append(parser.OGG_file_path)
+    return outputs
+
+
+def _silence_worker():
+    set_sink(NullSink())
+
+
+def _call_in_worker(function, task, verbose):
+    # Executors of Python 3.5 and 3.6 have no initializer, so every call sets the worker up
+    if not verbose:
+        _silence_worker()
+    return function(task)
+
+
+def run_in_workers(function, tasks, jobs, verbose=False):
+    """Yield results of `function` for every task of `tasks`, run by `jobs` worker processes, as soon as it's done.
+
+    `function` returns results in the same form _convert_task does, and so does a worker dying while running it,
+        killed for running out of memory or crashed by a decoder. Tasks that were running when a worker died
+        are run again one by one, so only the one that has killed its worker fails, and the rest go on.
+    Worker processes only show progress of their tasks if `verbose` is set."""
+    pending = deque(tasks)
+    suspects = deque()  # Tasks that were running when a worker died
+    while pending or suspects:
+        isolated = len(suspects) > 0
+        waiting = suspects if isolated else pending
+        workers = 1 if isolated else jobs
+        with ProcessPoolExecutor(workers) as executor:
+            running = {}
+            broken = False
+            while (waiting or running) and not broken:
+                while waiting and len(running) < workers:
+                    try:
+                        future = executor.submit(_call_in_worker, function, waiting[0], verbose)
+                    except BrokenProcessPool:
+                        # A worker has died while idle, running tasks tell whether it was one of theirs
+                        broken = True
+                        break
+                    running[future] = waiting.popleft()
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        broken = True
+                        if isolated:
+                            yield task[0], 'WorkerDied', 'Worker process has died while converting it', None
+                        else:
+                            suspects.append(task)
+                        continue
+                    except Exception as E:
+                        result = (task[0],) + _describe_error(E) + (None,)
+                    yield result
+            # Every task still running has failed along with the worker that has died
+            suspects.extend(running.values())
+
+
+def failure_line(chart, error_name, message):
+    """Line reporting that `chart` has failed to convert."""
+    if message:
+        return 'FAIL  {}: {}: {}'.format(chart, error_name, message)
+    return 'FAIL  {}: {}'.format(chart, error_name)
+
+
+# Manifest opened by this process, workers cannot share a connection
+_process_manifest = None
+
+
+def _open_manifest(options):
+    """Pop manifest path out of task `options` and set the manifest of this process as their audio index."""
+    global _process_manifest
+    manifest_path = options.pop('manifest_path', None)
+    if manifest_path is not None:
+        if _process_manifest is None or _process_manifest.database_path != manifest_path:
+            _process_manifest = Manifest(manifest_path)
+        options['audio_index'] = _process_manifest
+
+
+def _describe_error(error):
+    if isinstance(error, ConversionError):
+        return type(error).__name__, str(error)
+    # One broken chart must not take the whole library down with it
+    return 'Internal error ({})'.format(type(error).__name__), str(error)
+
+
+def _convert_task(task):
+    in_file, out_dir, keys, mode, options = task
+    options = dict(options)
+    _open_manifest(options)
+    try:
+        parser = convert_chart(in_file, out_dir, keys, mode, **options)
+    except Exception as E:
+        return (in_file,) + _describe_error(E) + (None,)
+    return in_file, None, None, (parser.sample_files, output_files(parser, mode))
+
+
+def _render_task(task):
+    """Same as _convert_task, but leaves encoding of audio to the pipeline.
+
+    Produced files come with the OGG file to be encoded, the mixed track and its fingerprint,
+        the track being None if there is nothing to encode."""
+    in_file, out_dir, keys, mode, options = task
+    options = dict(options)
+    _open_manifest(options)
+    try:
+        parser, track, fingerprint = render_chart(in_file, out_dir, keys, mode, **options)
+    except Exception as E:
+        return (in_file,) + _describe_error(E) + (None,)
+    return (in_file, None, None,
+            (parser.sample_files, output_files(parser, mode), parser.OGG_file_path, track, fingerprint))
+
+
+def make_tasks(charts, out_dir, keys, mode, options):
+    """Every chart is written into a subdirectory of `out_dir` named after its song directory,
+    or next to the chart itself if `out_dir` is not set.
+
+    Song directories sharing a name, such as the same song in different packs, would overwrite each other there,
+        so they are named after their paths starting from where those paths part instead."""
+    chart_dirs = {T: path.dirname(path.abspath(T)) for T in charts}
+    same_named = {}
+    for chart_dir in set(chart_dirs.values()):
+        same_named.setdefault(path.basename(chart_dir), []).append(chart_dir)
+
+    song_names = {}
+    for name, song_dirs in same_named.items():
+        if len(song_dirs) == 1:
+            song_names[song_dirs[0]] = name
+            continue
+        common_dir = path.commonpath([path.dirname(T) for T in song_dirs])
+        for song_dir in song_dirs:
+            song_names[song_dir] = path.relpath(song_dir, common_dir)
+
+    tasks = []
+    for chart in charts:
+        chart_dir = chart_dirs[chart]
+        chart_out_dir = (path.join(out_dir, song_names[chart_dir])
+                         if out_dir
+                         else chart_dir)
+        tasks.append((chart, chart_out_dir, keys, mode, options))
+    return tasks
+
+
+def _encode_tracks(tracks, events):
+    """Encoder thread, encodes tracks from `tracks` queue until it gets None and puts results into `events`.
+
+    Encoding runs in an ffmpeg subprocess, so encoders do not hold up the thread feeding workers."""
+    while True:
+        job = tracks.get()
+        if job is None:
+            return
+        in_file, produced = job
+        sample_files, outputs, ogg_file_path, track, fingerprint = produced
+        try:
+            track.export(ogg_file_path, format='ogg')
+        except Exception as E:
+            events.put(('encoded', (in_file,) + _describe_error(E) + (None,)))
+        else:
+            events.put(('encoded', (in_file, None, None, produced)))
+
+
+def _render_tracks(tasks, jobs, verbose, tracks, events):
+    """Feeder thread, renders `tasks` in worker processes and queues mixed tracks into `tracks` for encoders.
+
+    Results with nothing to encode go straight into `events`."""
+    for in_file, error_name, message, produced in run_in_workers(_render_task, tasks, jobs, verbose):
+        if error_name is None and produced[3] is not None:
+            # Blocks once the queue is full, which keeps workers from taking more charts
+            tracks.put((in_file, produced))
+        else:
+            events.put(('rendered', (in_file, error_name, message, produced)))
+
+
+def run_pipeline(tasks, jobs, encode_jobs, queue_size, verbose=False, manifest=None):
+    """Yield results of `tasks` in the same form _convert_task returns them, as soon as each chart is done.
+
+    Charts are parsed, composed and mixed by `jobs` worker processes, while `encode_jobs` threads of this process
+        encode tracks mixed so far, so parsing of a chart overlaps with mixing and encoding of the ones before it.
+    Mixed tracks wait for an encoder in a queue of `queue_size`, workers are not given more charts while it's full.
+    If `manifest` is set, audio is recorded there once it's encoded."""
+    events = queue.Queue()
+    tracks = queue.Queue(maxsize=queue_size)
+    encoders = [threading.Thread(target=_encode_tracks, args=(tracks, events), daemon=True)
+                for _ in range(encode_jobs)]
+    for encoder in encoders:
+        encoder.start()
+    feeder = threading.Thread(target=_render_tracks, args=(tasks, jobs, verbose, tracks, events), daemon=True)
+    feeder.start()
+
+    try:
+        # Every chart ends up in a single event, rendered if there is nothing to encode and encoded otherwise
+        for _ in range(len(tasks)):
+            stage_name, (in_file, error_name, message, produced) = events.get()
+            if (stage_name == 'encoded' and error_name is None and
+                    manifest is not None and produced[4] is not None):
+                manifest.record_audio(produced[4], produced[2])
+            yield in_file, error_name, message, None if produced is None else produced[:2]
+    finally:
+        feeder.join()
+        for _ in encoders:
+            tracks.put(None)
+        for encoder in encoders:
+            encoder.join()
+
+
+def run_batch(charts, out_dir, keys, mode, jobs, verbose=False, report=None, manifest=None,
+              encode_jobs=0, encode_queue=2, **options):
+    """Convert all `charts` using `jobs` worker processes and return a list of (chart, error name, message).
+
+    Result of every chart is written into `report`, standard output if it's not set, and sent to the progress sink.
+    Worker processes only show progress of their charts if `verbose` is set.
+    If `manifest` is set, charts it knows to be up to date are skipped, and every converted chart is recorded there
+        as soon as it's done, so an interrupted batch picks up where it has stopped.
+    If `encode_jobs` is set, audio is encoded by that many encoders instead of the worker that has mixed it,
+        see run_pipeline.
+    `options` are passed to convert_chart as is."""
+    report = report or sys.stdout
+    sink = get_sink()
+    if manifest is not None:
+        options = dict(options, manifest_path=manifest.database_path)
+    tasks = make_tasks(charts, out_dir, keys, mode, options)
+    chart_out_dirs = {T[0]: T[1] for T in tasks}
+
+    summary = []
+    if manifest is not None:
+        outdated_tasks = []
+        for task in tasks:
+            if manifest.is_up_to_date(task[0], task[1], keys, mode, options):
+                summary.append((task[0], None, None))
+                print('SKIP  {}'.format(task[0]), file=report)
+                sink.chart_skipped(task[0])
+            else:
+                outdated_tasks.append(task)
+        tasks = outdated_tasks
+    skipped = len(summary)
+
+    if encode_jobs > 0 and mode != 'SM':
+        results = run_pipeline(tasks, max(jobs, 1), encode_jobs, encode_queue, verbose, manifest)
+    elif jobs <= 1:
+        results = map(_convert_task, tasks)
+    else:
+        results = run_in_workers(_convert_task, tasks, jobs, verbose)
+
+    try:
+        for in_file, error_name, message, produced in results:
+            summary.append((in_file, error_name, message))
+            if manifest is not None:
+                if error_name is None:
+                    manifest.record(in_file, chart_out_dirs[in_file], keys, mode, options, *produced)
+                else:
+                    manifest.forget(in_file)
+            if error_name is None:
+                print('OK    {}'.format(in_file), file=report)
+            else:
+                print(failure_line(in_file, error_name, message), file=report)
+            report.flush()
+            sink.chart_finished(in_file, error_name, message)
+    finally:
+        if hasattr(results, 'close'):
+            results.close()
+
+    failed = sum(1 for T in summary if T[1] is not None)
+    print('Converted {} of {} charts, {} failed'.format(len(summary) - failed - skipped, len(summary), failed),
+          file=report)
+    if skipped:
+        print('{} charts were up to date'.format(skipped), file=report)
+    return summary
@@ -4,7 +4,7 @@ import operator
 from fractions import Fraction
 from functools import partial
 
-from bm2sm.definitions import DEFAULT_FRAME_RATE
+from bm2sm.definitions import CHART_POSITION_SPLIT, DEFAULT_FRAME_RATE
 from modules.fake_types import Castable, NonNegativeFraction, NonNegativeInt, PositiveFraction
 from modules.functions import feed_forward
 
@@ -33,6 +33,16 @@ def discretizer(precision):
     return discretize
 
 
+def discretize_ticks(numerator, denominator, precision):
+    """Find the closest multiple of integer `precision` for numerator / denominator using integers only.
+
+    Ties are resolved the same way discretizer does, towards the smaller multiple."""
+    multiple, remainder = divmod(numerator, denominator * precision)
+    if 2 * remainder > denominator * precision:
+        multiple += 1
+    return multiple * precision
+
+
 bpm_discretizer = discretizer(Fraction(1, 1000))
 # 0.001 in SM files is misleading, the actual accuracy seems to be 1/48.
 # Yet you still have to write in thousandths
@@ -43,7 +53,7 @@ beat_discretizer = partial(
         discretizer(Fraction(1, 1000))
     )
 )
-chart_position_discretizer = discretizer(Fraction(1, 192))  # Decoupled from beats
+chart_position_discretizer = discretizer(Fraction(1, CHART_POSITION_SPLIT))  # Decoupled from beats
 ms_stop_discretizer = discretizer(Fraction(1, 1000))
 sound_discretizer = discretizer(Fraction(1, DEFAULT_FRAME_RATE))
 
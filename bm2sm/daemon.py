@@ -0,0 +1,387 @@
+"""Long-running conversion service listening for jobs over HTTP on localhost.
+
+Worker processes are started once and keep everything they have loaded between jobs:
+    imported modules, decoded samples, indexes of song directories and encodings of songs.
+Jobs wait in a single queue, and a worker that is done takes the next chart of the song it has converted last
+    if one is waiting, so samples of a song are usually decoded only once, or else the oldest job waiting.
+Workers that die are replaced, and the job they were converting fails.
+
+Endpoints, all of them speak JSON:
+    POST /jobs with chart and optionally out_dir, keys, mode and mix_engine queues a job and returns its id.
+    GET /jobs/<id> returns state of the job, which is one of queued, running, done and failed.
+    GET /status returns queue depth, throughput and hit rate of samples kept in memory.
+    POST /shutdown stops the service once jobs queued so far are done.
+
+Paths of jobs are used as they are, so they should be absolute.
+"""
+
+import json
+import multiprocessing
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from itertools import count as iter_count
+from os import path
+from socketserver import ThreadingMixIn
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from bm2sm.OGG_converter import OGGConverter
+from bm2sm.batch import _convert_task
+from bm2sm.progress import NullSink, set_sink
+from bm2sm.sample_cache import SampleMemory
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+MODES = ('ALL', 'SM', 'AUDIO')
+# Finished jobs are forgotten, oldest first, once more than this many jobs are known
+FINISHED_JOBS_KEPT = 10000
+# Throughput is the amount of jobs finished over this many last seconds
+THROUGHPUT_WINDOW = 60
+# How often workers are checked for being alive while no results come in, in seconds
+WORKER_CHECK_INTERVAL = 1
+
+
+def _work(jobs, results, memory_limit, decode_jobs):
+    """Worker process converting `jobs` one by one and putting what has become of them into `results`."""
+    set_sink(NullSink())
+    memory = SampleMemory(memory_limit)
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+
+        job_id, chart, out_dir, keys, mode, mix_engine = job
+        results.put(('started', job_id))
+        options = {
+            'mix_engine': mix_engine,
+            'decode_jobs': decode_jobs,
+            'samples': memory
+        }
+        _, error_name, message, _ = _convert_task((chart, out_dir, keys, mode, options))
+        memory.evict()
+        results.put(('finished', job_id, error_name, message, (memory.hits, memory.misses, memory.size)))
+
+
+class ConversionDaemon(object):
+    """Queue of conversion jobs run by `workers` worker processes.
+
+    Every worker keeps up to `memory_limit` bytes of decoded samples, see SampleMemory.
+    """
+
+    def __init__(self, workers, mix_engine='layered', memory_limit=512 * 2 ** 20, decode_jobs=1):
+        self.mix_engine = mix_engine
+        self._memory_limit = memory_limit
+        self._decode_jobs = decode_jobs
+        self._started = time.time()
+        self._jobs = OrderedDict()
+        self._job_ids = iter_count(1)
+        # Notified whenever a job is done
+        self._lock = threading.Condition()
+        self._finish_times = deque()
+        self._completed = 0
+        self._failed = 0
+        self._restarted_workers = 0
+        self._stopping = False
+        # Song directory and conversion task of every job that is still queued, oldest first
+        self._pending = deque()
+        # Song directory and conversion task of the job every worker is converting, None for idle workers
+        self._running = [None] * workers
+        # Song directory of the latest job of every worker
+        self._worker_songs = [None] * workers
+        # Latest hits, misses and size of samples kept by every worker
+        self._worker_memory = [(0, 0, 0)] * workers
+
+        self._results = multiprocessing.Queue()
+        self._queues = [None] * workers
+        self._processes = [None] * workers
+        for worker in range(workers):
+            self._start_worker(worker)
+
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def _start_worker(self, worker):
+        jobs = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_work,
+                                          args=(jobs, self._results, self._memory_limit, self._decode_jobs),
+                                          daemon=True)
+        process.start()
+        self._queues[worker] = jobs
+        self._processes[worker] = process
+
+    def submit(self, chart, out_dir=None, keys='S1234567', mode='ALL', mix_engine=None):
+        """Queue conversion of `chart` and return id of the job."""
+        if mode not in MODES:
+            raise ValueError('Unknown mode: {}'.format(mode))
+        mix_engine = mix_engine or self.mix_engine
+        if mix_engine not in OGGConverter.MIX_ENGINES:
+            raise ValueError('Unknown mix engine: {}'.format(mix_engine))
+
+        with self._lock:
+            job_id = next(self._job_ids)
+            self._jobs[job_id] = OrderedDict((
+                ('id', job_id),
+                ('chart', chart),
+                ('state', 'queued'),
+                ('submitted', time.time())
+            ))
+            self._pending.append((path.dirname(path.abspath(chart)),
+                                  (job_id, chart, out_dir, keys, mode, mix_engine)))
+            self._dispatch()
+        return job_id
+
+    def _dispatch(self):
+        """Give a queued job to every idle worker, must be called with the lock held."""
+        for worker, running in enumerate(self._running):
+            if not self._pending:
+                return
+            if running is not None:
+                continue
+
+            # Samples of the song the worker has converted last are likely still in its memory
+            index = next((number
+                          for number, (song_dir, _) in enumerate(self._pending)
+                          if song_dir == self._worker_songs[worker]),
+                         0)
+            song_dir, task = self._pending[index]
+            del self._pending[index]
+
+            self._jobs[task[0]]['worker'] = worker
+            self._running[worker] = song_dir, task
+            self._worker_songs[worker] = song_dir
+            self._queues[worker].put(task)
+
+    def job(self, job_id):
+        """Return state of the job as a dict, None if there is no such job."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return None if job is None else OrderedDict(job)
+
+    def _collect(self):
+        while True:
+            try:
+                result = self._results.get(timeout=WORKER_CHECK_INTERVAL)
+            except queue.Empty:
+                self._replace_dead_workers()
+                continue
+            if result is None:
+                return
+            self._handle_result(result)
+            self._replace_dead_workers()
+
+    def _handle_result(self, result):
+        with self._lock:
+            job = self._jobs.get(result[1])
+            if job is None or job['state'] in ('done', 'failed'):
+                return
+            if result[0] == 'started':
+                job['state'] = 'running'
+                job['started'] = time.time()
+                return
+
+            _, _, error_name, message, memory = result
+            self._worker_memory[job['worker']] = memory
+            self._finish_job(job, error_name, message)
+
+    def _finish_job(self, job, error_name, message):
+        """Must be called with the lock held."""
+        job['finished'] = time.time()
+        if error_name is None:
+            job['state'] = 'done'
+            self._completed += 1
+        else:
+            job['state'] = 'failed'
+            job['error'] = error_name
+            job['message'] = message
+            self._failed += 1
+        running = self._running[job['worker']]
+        if running is not None and running[1][0] == job['id']:
+            self._running[job['worker']] = None
+        self._finish_times.append(job['finished'])
+        self._forget_finish_times(job['finished'])
+        self._forget_finished_jobs()
+        self._dispatch()
+        self._lock.notify_all()
+
+    def _replace_dead_workers(self):
+        with self._lock:
+            if self._stopping:
+                return
+            dead_workers = [number for number, T in enumerate(self._processes) if not T.is_alive()]
+        if not dead_workers:
+            return
+
+        # Everything a worker has put into results before dying is there by now, it may have finished its job
+        while True:
+            try:
+                result = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if result is None:
+                self._results.put(None)  # Still has to stop the collector
+                break
+            self._handle_result(result)
+
+        with self._lock:
+            for worker in dead_workers:
+                exit_code = self._processes[worker].exitcode
+                self._start_worker(worker)
+                self._restarted_workers += 1
+                hits, misses, _ = self._worker_memory[worker]
+                self._worker_memory[worker] = (hits, misses, 0)
+                running = self._running[worker]
+                if running is None:
+                    continue
+                job = self._jobs[running[1][0]]
+                if job['state'] == 'queued':
+                    # Never started, so it's up to another worker
+                    self._running[worker] = None
+                    del job['worker']
+                    self._pending.appendleft(running)
+                else:
+                    self._finish_job(job,
+                                     'WorkerDied',
+                                     'Worker process has exited with code {}'.format(exit_code))
+            self._dispatch()
+
+    def _forget_finish_times(self, now):
+        while self._finish_times and self._finish_times[0] < now - THROUGHPUT_WINDOW:
+            self._finish_times.popleft()
+
+    def _forget_finished_jobs(self):
+        excess = len(self._jobs) - FINISHED_JOBS_KEPT
+        if excess <= 0:
+            return
+        stale = []
+        for job_id, job in self._jobs.items():
+            if len(stale) == excess:
+                break
+            if job['state'] in ('done', 'failed'):
+                stale.append(job_id)
+        for job_id in stale:
+            del self._jobs[job_id]
+
+    def status(self):
+        """Return counters of the service as a dict."""
+        now = time.time()
+        with self._lock:
+            self._forget_finish_times(now)
+            states = [T['state'] for T in self._jobs.values()]
+            hits = sum(T[0] for T in self._worker_memory)
+            misses = sum(T[1] for T in self._worker_memory)
+            uptime = now - self._started
+            return OrderedDict((
+                ('uptime', uptime),
+                ('workers', len(self._processes)),
+                ('alive_workers', sum(1 for T in self._processes if T.is_alive())),
+                ('restarted_workers', self._restarted_workers),
+                ('queue_depth', states.count('queued')),
+                ('running', states.count('running')),
+                ('completed', self._completed),
+                ('failed', self._failed),
+                ('throughput', len(self._finish_times) / min(uptime, THROUGHPUT_WINDOW) if uptime else 0.0),
+                ('sample_memory', OrderedDict((
+                    ('hits', hits),
+                    ('misses', misses),
+                    ('hit_rate', hits / (hits + misses) if hits + misses else None),
+                    ('size', sum(T[2] for T in self._worker_memory))
+                )))
+            ))
+
+    def close(self):
+        """Stop workers once they are done with jobs queued so far."""
+        with self._lock:
+            while self._pending or any(T is not None for T in self._running):
+                self._lock.wait()
+            self._stopping = True
+        for jobs in self._queues:
+            jobs.put(None)
+        for process in self._processes:
+            process.join()
+        self._results.put(None)
+        self._collector.join()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    def _reply(self, code, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length).decode('utf-8')) if length else {}
+
+    def do_GET(self):
+        daemon = self.server.conversion_daemon
+        if self.path == '/status':
+            self._reply(200, daemon.status())
+        elif self.path.startswith('/jobs/') and self.path[len('/jobs/'):].isdigit():
+            job = daemon.job(int(self.path[len('/jobs/'):]))
+            if job is None:
+                self._reply(404, {'error': 'No such job'})
+            else:
+                self._reply(200, job)
+        else:
+            self._reply(404, {'error': 'Unknown endpoint'})
+
+    def do_POST(self):
+        daemon = self.server.conversion_daemon
+        if self.path == '/jobs':
+            try:
+                job = self._read_body()
+                job_id = daemon.submit(job['chart'],
+                                       job.get('out_dir'),
+                                       job.get('keys', 'S1234567'),
+                                       job.get('mode', 'ALL'),
+                                       job.get('mix_engine'))
+            except (ValueError, KeyError, TypeError) as E:
+                self._reply(400, {'error': '{}: {}'.format(type(E).__name__, E)})
+                return
+            self._reply(202, {'id': job_id})
+        elif self.path == '/shutdown':
+            self._reply(202, {})
+            # Serving loop can only be stopped from another thread
+            threading.Thread(target=self.server.shutdown).start()
+        else:
+            self._reply(404, {'error': 'Unknown endpoint'})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(conversion_daemon, host=DEFAULT_HOST, port=DEFAULT_PORT, verbose=False):
+    """Serve `conversion_daemon` until it's told to shut down, then stop its workers."""
+    server = _Server((host, port), _RequestHandler)
+    server.conversion_daemon = conversion_daemon
+    server.verbose = verbose
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        conversion_daemon.close()
+
+
+def request(method, endpoint, body=None, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """Send a request to the service and return its reply, replies with error codes raise ValueError."""
+    data = None if body is None else json.dumps(body).encode('utf-8')
+    http_request = Request('http://{}:{}{}'.format(host, port, endpoint),
+                           data=data,
+                           method=method,
+                           headers={'Content-Type': 'application/json'})
+    try:
+        with urlopen(http_request) as response:
+            return json.loads(response.read().decode('utf-8'))
+    except HTTPError as E:
+        raise ValueError(json.loads(E.read().decode('utf-8')).get('error', str(E)))
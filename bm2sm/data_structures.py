@@ -1,58 +1,58 @@
 from fractions import Fraction
+from io import BytesIO
 from itertools import count as iter_count
+from typing import Optional
 
 from pydub import AudioSegment
 
 from bm2sm.definitions import DEFAULT_FRAME_RATE, Keys
-from modules.decorators import transform_args, transform_return
+from bm2sm.profiling import count
+from bm2sm.sample_cache import SampleCache, canonical_segment
+from modules.decorators import coerce_args, transform_args, transform_return
 from modules.fake_types import CastableToInt, NonNegativeInt, PositiveInt
-from .custom_fake_types import Character, ChartPosition, Measure, Message, Segment, Time
+from .custom_fake_types import Character, Message, Segment, Time
 
 
 class Datum(object):
-    """Basic class representing a channel message from BM files."""
-    _initial_measure = ...  # type: Measure
-    _id = ...  # type: int
+    """Basic class representing a channel message from BM files.
+
+    Positions are integer ticks from the start of the chart, `ticks_per_measure` of them make a measure.
+    """
+    # Big charts are made of hundreds of thousands of these, so they don't get a __dict__
+    __slots__ = ('value', 'time_signature', 'global_position', '_id', '_initial_measure', '_initial_position')
     FREE_ID = 0  # type: int
 
-    @transform_args(..., Segment, Measure, ChartPosition, PositiveInt)
-    def __init__(self, value, measure, position, measure_split):
+    @transform_args(..., Segment, NonNegativeInt, NonNegativeInt, PositiveInt, PositiveInt)
+    def __init__(self, value, measure, position, measure_split, ticks_per_measure):
         assert position < measure_split
+        assert ticks_per_measure % measure_split == 0
 
-        self.value = value
-        self._id = self.FREE_ID
-        self._initial_measure = measure
-        self._initial_position = self.initial_measure + Fraction(position, measure_split)
+        self.value = value  # type: Segment
+        self._id = self.FREE_ID  # type: int
+        self._initial_measure = measure  # type: int
+        self._initial_position = (measure * ticks_per_measure +
+                                  position * (ticks_per_measure // measure_split))  # type: int
 
-        self._global_position = self.initial_position
+        self.global_position = self._initial_position  # type: int
 
         Datum.FREE_ID += 1
 
     @classmethod
-    @transform_args(..., Message, Measure)
-    def from_message(cls, message, measure):
+    @coerce_args(..., Message, NonNegativeInt, PositiveInt)
+    def from_message(cls, message, measure, ticks_per_measure):
         pairs = [''.join(T) for T in zip(message[::2], message[1::2])]
 
         measure_split = len(pairs)
         enumerated_pairs = zip(iter_count(), pairs)
 
         result = [
-            cls(datum, measure, position, measure_split)
+            cls(datum, measure, position, measure_split, ticks_per_measure)
             for position, datum in enumerated_pairs
             if datum != '00'
         ]
 
         return result
 
-    @property
-    def global_position(self):
-        return self._global_position
-
-    @global_position.setter
-    def global_position(self, value: ChartPosition):
-        value = ChartPosition(value)
-        self._global_position = value
-
     @property
     def initial_measure(self):
         return self._initial_measure
@@ -63,41 +63,35 @@ class Datum(object):
 
 
 class NotefieldObject(object):
-    """Basic object representing an object on a notefield."""
-    position = ...  # type: ChartPosition
-    measure = ...  # type: NonNegativeInt
-    key = ...  # type: CastableToInt
-    symbol = ...  # type: Character
+    """Basic object representing an object on a notefield, its position is in ticks same as Datum's."""
+    __slots__ = ('position', 'key', 'symbol')
 
-    @transform_args(..., Measure, CastableToInt, Character)
+    @transform_args(..., NonNegativeInt, CastableToInt, Character)
     def __init__(self, position, key, symbol):
         assert key in Keys.__dict__.values()
-        self.position = position
-        self.measure = position.numerator // position.denominator
-        self.key = key
-        self.symbol = symbol
+        self.position = position  # type: int
+        self.key = key  # type: CastableToInt
+        self.symbol = symbol  # type: Character
 
 
 class Sound(object):
     """Basic object representing a sound in the audio file."""
-    _id = ...  # type: Segment
-    sound = ...  # type: AudioSegment
-    _time = ...  # type: Time
+    __slots__ = ('_id', 'sound', '_time', 'location')
 
-    @transform_args(..., Segment, ..., Time)
-    def __init__(self, wav_id, sound, time):
+    @transform_args(..., Segment, ..., Time, ...)
+    def __init__(self, wav_id, sound, time, location=None):
         # `id` ended up unused after rewriting audio file baking.
         #   It was used to group sounds in layers and simulate sounds being cutoff
         #     as described in the reference
         assert sound
 
-        self._id = wav_id
-        self.sound = sound
+        self._id = wav_id  # type: Segment
+        # Shared by every placement of the same sample, which has already brought it into canonical format
+        self.sound = sound  # type: AudioSegment
+        # File the sample has been loaded from, if there is one
+        self.location = location  # type: Optional[str]
 
-        if self.sound.frame_rate != DEFAULT_FRAME_RATE:
-            self.sound = self.sound.set_frame_rate(DEFAULT_FRAME_RATE)
-
-        self._time = Time(1000 * time)
+        self._time = Time(1000 * time)  # type: Time
 
     @property
     @transform_return(Time)
@@ -107,7 +101,7 @@ class Sound(object):
     @property
     @transform_return(NonNegativeInt)
     def start_time_frames(self):
-        return Fraction(DEFAULT_FRAME_RATE, 1000) * self.start_time_ms
+        return int(Fraction(DEFAULT_FRAME_RATE, 1000) * self.start_time_ms)
 
     @property
     @transform_return(Time)
@@ -130,20 +124,71 @@ class Sound(object):
         return self.start_time_frames + self.duration_frames
 
 
+# Formats of samples held in memory by how their files start, anything else is left for ffmpeg to probe
+_SAMPLE_SIGNATURES = (
+    (b'RIFF', 'wav'),
+    (b'OggS', 'ogg'),
+    (b'fLaC', 'flac'),
+    (b'ID3', 'mp3'),
+    (b'\xff\xfb', 'mp3'),
+    (b'\xff\xf3', 'mp3'),
+    (b'\xff\xf2', 'mp3')
+)
+
+
+def _sample_format(data):
+    for signature, sample_format in _SAMPLE_SIGNATURES:
+        if data.startswith(signature):
+            return sample_format
+    return None
+
+
 class SoundSample(object):
-    """Basic object representing a loaded keynote sound."""
+    """Basic object representing a loaded keynote sound.
+
+    The segment is converted into canonical format once, when it's loaded.
+    Sample is decoded from the file at `location`, or from `data` bytes of such a file if they are given.
+    """
+    __slots__ = ('_location', '_segment', '_cache', '_data')
 
-    _location = ...  # type: str
-    _segment = ...  # type: AudioSegment
+    def __init__(self, location, cache=None, data=None):
+        self._location = location  # type: Optional[str]
+        self._segment = None  # type: Optional[AudioSegment]
+        self._cache = cache  # type: Optional[SampleCache]
+        self._data = data  # type: Optional[bytes]
 
-    def __init__(self, location):
-        self._location = location
-        self._segment = None
+    @property
+    def location(self):
+        return self._location
+
+    @property
+    def decoded_size(self):
+        """Bytes taken by the decoded segment, 0 if it has not been decoded yet."""
+        return len(self._segment.raw_data) if self._segment else 0
 
     @property
     def segment(self):
         if self._segment:
             return self._segment
-        self._segment = AudioSegment.from_file(self._location)
+        if self._data is not None:
+            count('sample decodes')
+            self._segment = canonical_segment(AudioSegment.from_file(BytesIO(self._data),
+                                                                     format=_sample_format(self._data)))
+            self._data = None  # Only the segment is needed from now on
+        elif self._cache is not None:
+            self._segment = self._cache.load(self._location)
+        else:
+            count('sample decodes')
+            self._segment = canonical_segment(AudioSegment.from_file(self._location))
         assert self._segment
         return self._segment
+
+    def preload(self):
+        """Decode the sample ahead of time.
+
+        Failures are ignored here, decoding is attempted again and fails where the sample is actually used."""
+        try:
+            self.segment
+        except Exception:
+            pass
+        return self
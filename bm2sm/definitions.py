@@ -1,15 +1,10 @@
-import sys
-
-from tqdm import tqdm
-
 DEFAULT_FRAME_RATE = 44100
-
-
-def standard_tqdm(*args, **kwargs):
-    return tqdm(*args,
-                bar_format='{desc:>36} @ {percentage:>3.0f}% [{remaining:>5}] [{n:>6}/{total:>6}]|{bar}|',
-                file=sys.stdout,  # Not sure why tqdm outputs to stderr by default
-                **kwargs)
+DEFAULT_SAMPLE_WIDTH = 2
+DEFAULT_CHANNELS = 2
+# Must be bumped whenever the same chart starts being converted differently, so incremental conversions notice
+CONVERTER_VERSION = 1
+# Positions on the chart are snapped to 1/192 of a measure whenever they are moved
+CHART_POSITION_SPLIT = 192
 
 
 class Keys(object):
@@ -0,0 +1,54 @@
+"""Conversion of charts held in memory, for callers that neither have them on disk nor want outputs written there.
+
+Charts are converted from bytes, samples are asked for by name, and the SM chart and audio are returned as buffers.
+Raw PCM never touches the disk. Encoding it is done by ffmpeg through pydub, which does use temporary files.
+"""
+
+from collections import namedtuple
+from io import BytesIO, StringIO
+
+from bm2sm.BM_parser import BMChartParser
+from bm2sm.SM_converter import SMChartConverter
+
+# `sm` is text of the SM chart, `audio` is raw PCM or encoded audio, either is None if it has not been asked for.
+#   `parser` has everything else known about the chart.
+ConvertedChart = namedtuple('ConvertedChart', ('sm', 'audio', 'parser'))
+
+
+def convert_chart_data(chart_data, resolve_sample=None, keys='S1234567', mode='ALL', name='chart',
+                       mix_engine='layered', audio_format=None, **parser_options):
+    """Convert BM chart from `chart_data` bytes and return ConvertedChart.
+
+    `resolve_sample` is called with every file name #WAV headers of the chart refer to,
+        and returns contents of that file as bytes, or None if there is no such file.
+        It's only needed to bake audio.
+    `mode` is one of ALL, SM and AUDIO, same as the converter has.
+    `name` names audio file the SM chart refers to, which is `name`.ogg.
+    Audio is raw PCM in DEFAULT_FRAME_RATE, DEFAULT_SAMPLE_WIDTH and DEFAULT_CHANNELS format,
+        or encoded in `audio_format`, such as 'ogg', if it's set.
+    Parser can be told to share decoded samples with other charts by passing `samples` in `parser_options`,
+        a dict it fills with samples by their names, see BMChartParser.
+    """
+    load_sounds = mode != 'SM'
+    if load_sounds and resolve_sample is None:
+        raise ValueError('Samples have to be resolved to bake audio')
+
+    parser = BMChartParser(name + '.bms', None, keys, load_sounds,
+                           chart_data=chart_data, resolve_sample=resolve_sample, **parser_options)
+
+    sm = None
+    if mode != 'AUDIO':
+        sm_file = StringIO(newline='')
+        SMChartConverter.write_sm(sm_file, parser.OGG_file_name, (parser.SM_converter,))
+        sm = sm_file.getvalue()
+
+    audio = None
+    if load_sounds:
+        if audio_format is None:
+            audio = parser.OGG_converter.mix(mix_engine).raw_data
+        else:
+            audio_file = BytesIO()
+            parser.OGG_converter.export_audio(audio_file, mix_engine, audio_format)
+            audio = audio_file.getvalue()
+
+    return ConvertedChart(sm, audio, parser)
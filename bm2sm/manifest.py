@@ -0,0 +1,114 @@
+"""Manifest of converted charts, used to skip charts that would be converted into the same files again."""
+
+import json
+import sqlite3
+from os import path, stat
+
+from bm2sm.definitions import CONVERTER_VERSION
+from modules.functions import file_digest
+
+
+def _file_state(file_path):
+    """Size and modification time of the file at `file_path`, None if it's missing."""
+    try:
+        file_stat = stat(file_path)
+    except OSError:
+        return None
+    return [file_stat.st_size, file_stat.st_mtime_ns]
+
+
+def _files_state(file_paths):
+    return sorted([T, _file_state(T)] for T in file_paths)
+
+
+class Manifest(object):
+    """SQLite database of every chart converted so far.
+
+    A chart is recorded with everything its outputs depend on: contents of the chart itself, directory it's
+        converted into, key mapping, mode, options and version of the converter, and state of every sample it uses.
+    State of the outputs is recorded too, so charts whose outputs were changed or removed are converted again.
+
+    Baked audio files are recorded by fingerprints of their sounds, so charts playing the same sounds
+        reuse audio baked for another chart instead of baking it again.
+    """
+    database_path = ...  # type: str
+
+    def __init__(self, database_path):
+        self.database_path = database_path
+        # Worker processes of a batch each have a connection of their own, so waiting for a lock is expected
+        self._connection = sqlite3.connect(database_path, timeout=60)
+        with self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS charts ('
+                                     'chart TEXT PRIMARY KEY, '
+                                     'fingerprint TEXT NOT NULL, '
+                                     'samples TEXT NOT NULL, '
+                                     'outputs TEXT NOT NULL)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS audio ('
+                                     'fingerprint TEXT PRIMARY KEY, '
+                                     'file TEXT NOT NULL, '
+                                     'state TEXT NOT NULL)')
+
+    @staticmethod
+    def fingerprint(chart, out_dir, keys, mode, options):
+        """Everything outputs of `chart` converted into `out_dir` depend on, other than its samples."""
+        return json.dumps([
+            CONVERTER_VERSION,
+            file_digest(chart),
+            path.abspath(out_dir or path.dirname(chart)),
+            keys,
+            mode,
+            options.get('mix_engine')
+        ])
+
+    def is_up_to_date(self, chart, out_dir, keys, mode, options):
+        """Return True if converting `chart` into `out_dir` again would produce the same outputs it already has."""
+        chart = path.abspath(chart)
+        row = self._connection.execute('SELECT fingerprint, samples, outputs FROM charts WHERE chart = ?',
+                                       (chart,)).fetchone()
+        if row is None:
+            return False
+
+        fingerprint, samples, outputs = row
+        samples, outputs = json.loads(samples), json.loads(outputs)
+        return (fingerprint == self.fingerprint(chart, out_dir, keys, mode, options) and
+                samples == _files_state(T[0] for T in samples) and
+                outputs == _files_state(T[0] for T in outputs) and
+                all(T[1] is not None for T in outputs))
+
+    def record(self, chart, out_dir, keys, mode, options, samples, outputs):
+        """Remember `chart` has just been converted from `samples` into `outputs` in `out_dir`."""
+        chart = path.abspath(chart)
+        with self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO charts VALUES (?, ?, ?, ?)', (
+                chart,
+                self.fingerprint(chart, out_dir, keys, mode, options),
+                json.dumps(_files_state(path.abspath(T) for T in samples)),
+                json.dumps(_files_state(path.abspath(T) for T in outputs))
+            ))
+
+    def forget(self, chart):
+        """Make sure `chart` is converted next time, used when its conversion fails."""
+        with self._connection:
+            self._connection.execute('DELETE FROM charts WHERE chart = ?', (path.abspath(chart),))
+
+    def find_audio(self, fingerprint):
+        """Return path of an audio file baked from sounds with `fingerprint`, None if there is none left unchanged."""
+        row = self._connection.execute('SELECT file, state FROM audio WHERE fingerprint = ?',
+                                       (fingerprint,)).fetchone()
+        if row is None:
+            return None
+
+        file_path, state = row
+        if json.loads(state) != _file_state(file_path):
+            return None
+        return file_path
+
+    def record_audio(self, fingerprint, file_path):
+        """Remember audio file at `file_path` has just been baked from sounds with `fingerprint`."""
+        file_path = path.abspath(file_path)
+        with self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO audio VALUES (?, ?, ?)',
+                                     (fingerprint, file_path, json.dumps(_file_state(file_path))))
+
+    def close(self):
+        self._connection.close()
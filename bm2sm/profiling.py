@@ -0,0 +1,234 @@
+"""Opt-in instrumentation of conversion stages.
+
+Stages are marked with the profiled decorator or the stage context manager,
+    and cost a single check while profiling is off, which it is unless enable_profiling has been called.
+Every stage records wall and CPU time, and optionally peak memory allocated during it and cProfile statistics.
+Stages started within another stage are recorded under its name, like 'dynamic data/timing fix'.
+
+Counters of events too frequent to be stages are kept too. Counting casts of Castable types
+    and time lookups would slow down conversion for everyone, so those are only hooked in once profiling is enabled.
+Profiling covers the process it is enabled in.
+"""
+
+import cProfile
+import json
+import pstats
+import time
+import tracemalloc
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock
+from typing import Optional
+
+from bm2sm.definitions import CONVERTER_VERSION
+
+# Profiler of this process, None while profiling is off
+_profiler = None
+# Samples are decoded by several threads at once
+_counters_lock = Lock()
+
+
+class _StageRecord(object):
+    __slots__ = ('calls', 'wall_time', 'cpu_time', 'peak_memory', 'statistics')
+
+    def __init__(self):
+        self.calls = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.peak_memory = None
+        self.statistics = None  # type: Optional[pstats.Stats]
+
+
+class Profiler(object):
+    """Collects time, memory and cProfile statistics of stages, and counters of events.
+
+    If `trace_memory` is set, peak memory of a stage is the most memory allocated during it
+        on top of what was allocated when it has started. Tracing allocations slows everything down a lot,
+        and needs Python 3.9 or newer.
+    If `capture_cprofile` is set, every stage is profiled with cProfile on its own,
+        nested stages are left out of statistics of the stage containing them.
+    """
+    # How many functions with the most cumulative time are reported for every stage
+    CPROFILE_ENTRIES = 25
+
+    def __init__(self, trace_memory=False, capture_cprofile=False):
+        self.trace_memory = trace_memory
+        self.capture_cprofile = capture_cprofile
+        self.counters = defaultdict(int)
+        self._stages = OrderedDict()
+        # Name, memory allocated at the start and the greatest peak of finished nested stages of every open stage
+        self._open_stages = []
+        self._open_profiles = []
+        self._started = time.perf_counter()
+
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def count(self, counter, amount=1):
+        self.counters[counter] += amount
+
+    @contextmanager
+    def stage(self, name):
+        if self._open_stages:
+            name = self._open_stages[-1][0] + '/' + name
+        record = self._stages.get(name)
+        if record is None:
+            record = self._stages[name] = _StageRecord()
+
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._open_stages:
+                self._open_stages[-1][2] = max(self._open_stages[-1][2], peak)
+            # Peak cannot be reset before Python 3.9, stages then get the highest peak of the process so far
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self._open_stages.append([name, current, current])
+        else:
+            self._open_stages.append([name, 0, 0])
+
+        if self.capture_cprofile:
+            if self._open_profiles:
+                self._open_profiles[-1].disable()
+            profile = cProfile.Profile()
+            self._open_profiles.append(profile)
+            profile.enable()
+
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall_time, cpu_time = time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+            if self.capture_cprofile:
+                profile = self._open_profiles.pop()
+                profile.disable()
+                if record.statistics is None:
+                    record.statistics = pstats.Stats(profile)
+                else:
+                    record.statistics.add(profile)
+                if self._open_profiles:
+                    self._open_profiles[-1].enable()
+
+            _, memory_at_start, nested_peak = self._open_stages.pop()
+            if self.trace_memory:
+                peak = max(nested_peak, tracemalloc.get_traced_memory()[1])
+                record.peak_memory = max(record.peak_memory or 0, peak - memory_at_start)
+                if self._open_stages:
+                    self._open_stages[-1][2] = max(self._open_stages[-1][2], peak)
+
+            record.calls += 1
+            record.wall_time += wall_time
+            record.cpu_time += cpu_time
+
+    def _cprofile_entries(self, statistics):
+        entries = sorted(statistics.stats.items(), key=lambda T: T[1][3], reverse=True)
+        return [{
+            'function': '{}:{}({})'.format(*function),
+            'calls': calls,
+            'total_time': total_time,
+            'cumulative_time': cumulative_time
+        } for function, (_, calls, total_time, cumulative_time, _) in entries[:self.CPROFILE_ENTRIES]]
+
+    def report(self):
+        """Everything collected so far as a JSON serializable dict."""
+        stages = []
+        for name, record in self._stages.items():
+            stage = OrderedDict((
+                ('stage', name),
+                ('calls', record.calls),
+                ('wall_time', record.wall_time),
+                ('cpu_time', record.cpu_time),
+                ('peak_memory', record.peak_memory)
+            ))
+            if record.statistics is not None:
+                stage['cprofile'] = self._cprofile_entries(record.statistics)
+            stages.append(stage)
+
+        return OrderedDict((
+            ('converter_version', CONVERTER_VERSION),
+            ('wall_time', time.perf_counter() - self._started),
+            ('stages', stages),
+            ('counters', OrderedDict(sorted(self.counters.items())))
+        ))
+
+    def dump(self, file_path):
+        with open(file_path, 'w', encoding='utf-8') as out_file:
+            json.dump(self.report(), out_file, indent=2)
+
+
+def _install_counters():
+    """Hook counters into code that is too hot to check whether profiling is on."""
+    from bm2sm.timing_manager import TimingSectionManager
+    from modules.fake_types import Castable
+
+    cast = Castable.__new__
+
+    def counted_cast(cls, it, caller=None):
+        _profiler.counters['castable casts'] += 1
+        return cast(cls, it, caller)
+
+    Castable.__new__ = staticmethod(counted_cast)
+
+    fix = TimingSectionManager.fix
+
+    @wraps(fix)
+    def counted_fix(self):
+        fix(self)
+        position_to_time = self._position_to_time
+
+        def counted_position_to_time(position):
+            _profiler.counters['position to time calls'] += 1
+            return position_to_time(position)
+
+        self._position_to_time = counted_position_to_time
+
+    TimingSectionManager.fix = counted_fix
+
+
+def enable_profiling(trace_memory=False, capture_cprofile=False):
+    """Start profiling this process and return the profiler, see Profiler."""
+    global _profiler
+    if _profiler is None:
+        _install_counters()
+    _profiler = Profiler(trace_memory, capture_cprofile)
+    return _profiler
+
+
+def get_profiler():
+    return _profiler
+
+
+@contextmanager
+def _null_stage():
+    yield
+
+
+def stage(name):
+    """Context manager recording everything within it as stage `name`, if profiling is on."""
+    if _profiler is None:
+        return _null_stage()
+    return _profiler.stage(name)
+
+
+def count(counter, amount=1):
+    """Add `amount` to `counter`, if profiling is on. Meant for events that happen at most once per sample or so."""
+    if _profiler is not None:
+        with _counters_lock:
+            _profiler.count(counter, amount)
+
+
+def profiled(name):
+    """Decorator recording every call of the function as stage `name`, if profiling is on."""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            with _profiler.stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
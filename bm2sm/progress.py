@@ -0,0 +1,206 @@
+"""Progress bars and messages of conversion, sent to a process-wide sink.
+
+Converting code reports through progress and message, and the sink decides what becomes of them:
+
+NullSink:
+    Nothing is shown, progress is a plain wrapper of the iterable and no bar is ever created.
+
+TerminalSink:
+    A tqdm bar for every stage of every chart and messages written above them, this is the default.
+
+AggregateSink:
+    A single bar of converted charts for the whole batch, stages are only counted and messages are dropped.
+
+JsonLinesSink:
+    Every stage, message and converted chart is written as a JSON object on a line of its own,
+        meant for other programs to follow conversion.
+
+Sinks never redirect sys.stdout or sys.stderr, so anything else printed is left as it is.
+"""
+
+import json
+import sys
+import time
+from collections import OrderedDict
+
+from tqdm import tqdm
+
+BAR_FORMAT = '{desc:>36} @ {percentage:>3.0f}% [{remaining:>5}] [{n:>6}/{total:>6}]|{bar}|'
+
+
+class _NullProgress(object):
+    """Progress of a stage that is not shown anywhere, iterating it iterates the iterable itself."""
+    __slots__ = ('iterable', 'desc', 'total', 'n', 'started', '_sink')
+
+    def __init__(self, sink, iterable=None, desc=None, total=None):
+        self.iterable = iterable
+        self.desc = desc
+        if total is None and iterable is not None:
+            try:
+                total = len(iterable)
+            except TypeError:
+                pass  # Only known once it's exhausted
+        self.total = total
+        self.n = 0
+        self.started = time.perf_counter() if sink is not None else None
+        self._sink = sink
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def update(self, amount=1):
+        self.n += amount
+
+    def set_description(self, desc):
+        self.desc = desc
+
+    def close(self):
+        if self._sink is not None:
+            self._sink.progress_closed(self)
+            self._sink = None
+
+
+class NullSink(object):
+    """Sink that ignores everything, also the base of every other sink."""
+
+    def progress(self, iterable=None, desc=None, total=None, leave=True):
+        """Return progress of a stage going through `iterable` or `total` steps, usable like a tqdm bar."""
+        return _NullProgress(None, iterable, desc, total)
+
+    def progress_closed(self, progress):
+        pass
+
+    def message(self, text):
+        pass
+
+    def chart_finished(self, chart, error_name=None, error_message=None):
+        """Called once a chart of a batch has been converted, or has failed if `error_name` is set."""
+        pass
+
+    def chart_skipped(self, chart):
+        """Called for every chart of a batch that is up to date and is not converted."""
+        pass
+
+
+class TerminalSink(NullSink):
+    """Sink showing a tqdm bar for every stage in `file`, standard output if it's not set."""
+
+    def __init__(self, file=None):
+        self.file = file
+
+    def progress(self, iterable=None, desc=None, total=None, leave=True):
+        return tqdm(iterable=iterable,
+                    desc=desc,
+                    total=total,
+                    leave=leave,
+                    bar_format=BAR_FORMAT,
+                    file=self.file or sys.stdout)
+
+    def message(self, text):
+        tqdm.write(text, file=self.file or sys.stdout)
+
+
+class AggregateSink(NullSink):
+    """Sink showing a single bar of `total_charts` charts converted so far in `file`, standard error if it's not set.
+
+    Stages are not shown, only steps done in them are summed up by their description, see totals.
+    Messages of single charts are dropped too, what has become of every chart is in the report of the batch.
+    """
+
+    def __init__(self, total_charts=None, file=None):
+        self.totals = OrderedDict()
+        self.failed = 0
+        self._bar = tqdm(total=total_charts,
+                         desc='Converting charts',
+                         unit='chart',
+                         file=file or sys.stderr)
+
+    def progress(self, iterable=None, desc=None, total=None, leave=True):
+        return _NullProgress(self, iterable, desc, total)
+
+    def progress_closed(self, progress):
+        if progress.desc:
+            self.totals[progress.desc] = self.totals.get(progress.desc, 0) + (progress.n or progress.total or 0)
+
+    def chart_finished(self, chart, error_name=None, error_message=None):
+        if error_name is not None:
+            self.failed += 1
+            self._bar.set_postfix(failed=self.failed)
+        self._bar.update()
+
+    def chart_skipped(self, chart):
+        self._bar.update()
+
+    def close(self):
+        self._bar.close()
+
+
+class JsonLinesSink(NullSink):
+    """Sink writing a JSON object per line for every stage, message and chart into text `file`.
+
+    Every object has 'event' and 'time' fields, the rest depends on the event:
+        stage: 'desc', 'total' and 'elapsed' seconds, written once the stage is over
+        message: 'text'
+        chart: 'chart', 'status' being one of OK, FAIL and SKIP, and 'error' and 'message' if it has failed
+    """
+
+    def __init__(self, file):
+        self.file = file
+
+    def _write(self, event, **fields):
+        fields = OrderedDict((('event', event), ('time', time.time())), **fields)
+        self.file.write(json.dumps(fields, ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def progress(self, iterable=None, desc=None, total=None, leave=True):
+        return _NullProgress(self, iterable, desc, total)
+
+    def progress_closed(self, progress):
+        if progress.desc is None:
+            return  # Inner steps of a stage that has one of its own
+        self._write('stage',
+                    desc=progress.desc,
+                    total=progress.n or progress.total,
+                    elapsed=time.perf_counter() - progress.started)
+
+    def message(self, text):
+        self._write('message', text=text)
+
+    def chart_finished(self, chart, error_name=None, error_message=None):
+        if error_name is None:
+            self._write('chart', chart=chart, status='OK')
+        else:
+            self._write('chart', chart=chart, status='FAIL', error=error_name, message=error_message)
+
+    def chart_skipped(self, chart):
+        self._write('chart', chart=chart, status='SKIP')
+
+
+# Sink of this process
+_sink = TerminalSink()
+
+
+def get_sink():
+    return _sink
+
+
+def set_sink(sink):
+    """Send progress and messages of this process into `sink` from now on, return the previous sink."""
+    global _sink
+    previous, _sink = _sink, sink
+    return previous
+
+
+def progress(iterable=None, desc=None, total=None, leave=True):
+    """Progress of a stage reported to the sink of this process, see NullSink.progress."""
+    return _sink.progress(iterable=iterable, desc=desc, total=total, leave=leave)
+
+
+def message(text):
+    _sink.message(text)
@@ -0,0 +1,199 @@
+"""Caches of decoded keysounds, a persistent one on disk and one in memory of a long-running process."""
+
+import hashlib
+from collections import OrderedDict
+from os import getpid, listdir, makedirs, path, remove, replace, stat, utime
+from threading import get_ident
+
+from pydub import AudioSegment
+
+from bm2sm.definitions import DEFAULT_CHANNELS, DEFAULT_FRAME_RATE, DEFAULT_SAMPLE_WIDTH
+from bm2sm.profiling import count
+from modules.functions import LRUCache, file_digest
+
+# Samples are usually shared by many charts, so each one is only read once as long as it stays the same
+_sample_digests = LRUCache(1 << 16)
+
+
+def canonical_segment(segment):
+    """Convert `segment` into the format every sound is mixed in."""
+    if (segment.frame_rate, segment.sample_width, segment.channels) != \
+            (DEFAULT_FRAME_RATE, DEFAULT_SAMPLE_WIDTH, DEFAULT_CHANNELS):
+        count('sample conversions')
+    return (segment
+            .set_frame_rate(DEFAULT_FRAME_RATE)
+            .set_sample_width(DEFAULT_SAMPLE_WIDTH)
+            .set_channels(DEFAULT_CHANNELS))
+
+
+def sample_digest(location):
+    """Digest of contents of the sample at `location`, remembered for as long as its size and modification time stay."""
+    location = path.abspath(location)
+    file_stat = stat(location)
+    key = (location, file_stat.st_size, file_stat.st_mtime_ns)
+    digest = _sample_digests.get(key)
+    if digest is None:
+        digest = _sample_digests[key] = file_digest(location)
+    return digest
+
+
+class SampleCache(object):
+    """On-disk cache of decoded keysounds.
+
+    Every entry is raw PCM in canonical format, so it's read as is
+        and no decoding or resampling is needed when it's used again.
+    Least recently used entries are evicted once the cache grows past `size_limit` bytes.
+    """
+    _extension = '.pcm'
+    # Evictions leave this share of `size_limit` taken, so a full cache is not scanned again on every store
+    _eviction_target = 0.9
+
+    cache_dir = ...  # type: str
+    size_limit = ...  # type: int
+
+    def __init__(self, cache_dir, size_limit):
+        self.cache_dir = cache_dir
+        self.size_limit = size_limit
+        # Bytes taken by entries as far as this process knows, counted by the first eviction
+        self._size = None
+        makedirs(cache_dir, exist_ok=True)
+
+    def _entry_path(self, location):
+        location = path.abspath(location)
+        file_stat = stat(location)
+        key = '|'.join(str(T) for T in (
+            location,
+            file_stat.st_size,
+            file_stat.st_mtime_ns,
+            sample_digest(location),
+            DEFAULT_FRAME_RATE,
+            DEFAULT_SAMPLE_WIDTH,
+            DEFAULT_CHANNELS
+        ))
+        return path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + self._extension)
+
+    @staticmethod
+    def _read(entry_path):
+        # Read rather than mapped, charts may use more keysounds than a process may have files open
+        with open(entry_path, 'rb') as entry_file:
+            data = entry_file.read()
+        # Access time is not reliable on most mounts, so modification time is used for LRU instead
+        utime(entry_path)
+        return AudioSegment(data=data,
+                            sample_width=DEFAULT_SAMPLE_WIDTH,
+                            frame_rate=DEFAULT_FRAME_RATE,
+                            channels=DEFAULT_CHANNELS)
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits into `size_limit`, with some room to spare."""
+        entries = []
+        for file_name in listdir(self.cache_dir):
+            if not file_name.endswith(self._extension):
+                continue
+            entry_path = path.join(self.cache_dir, file_name)
+            try:
+                entry_stat = stat(entry_path)
+            except OSError:
+                continue
+            entries.append((entry_stat.st_mtime_ns, entry_stat.st_size, entry_path))
+
+        total_size = sum(T[1] for T in entries)
+        if total_size <= self.size_limit:
+            self._size = total_size
+            return
+        for _, size, entry_path in sorted(entries):
+            if total_size <= self.size_limit * self._eviction_target:
+                break
+            try:
+                remove(entry_path)
+            except OSError:
+                # Most likely still open by someone on a platform that disallows that
+                continue
+            total_size -= size
+        self._size = total_size
+
+    def load(self, location, decoder=AudioSegment.from_file):
+        """Return canonical segment for the sound at `location`, decoding it with `decoder` only if needed."""
+        entry_path = self._entry_path(location)
+        if path.exists(entry_path):
+            try:
+                segment = self._read(entry_path)
+                count('sample cache hits')
+                return segment
+            except OSError:
+                pass  # Evicted in the meantime
+
+        count('sample decodes')
+        segment = canonical_segment(decoder(location))
+
+        temp_path = '{}.{}.{}.tmp'.format(entry_path, getpid(), get_ident())
+        with open(temp_path, 'wb') as entry_file:
+            entry_file.write(segment.raw_data)
+        replace(temp_path, entry_path)
+
+        # Other processes may be writing into the cache too, their entries are only counted by evictions
+        if self._size is not None:
+            self._size += len(segment.raw_data)
+        if self._size is None or self._size > self.size_limit:
+            self.evict()
+        return segment
+
+
+def _file_state(location):
+    try:
+        file_stat = stat(location)
+    except OSError:
+        return None
+    return file_stat.st_size, file_stat.st_mtime_ns
+
+
+class SampleMemory(object):
+    """Samples kept in memory by their locations, for a process converting chart after chart.
+
+    Usable as `samples` of BMChartParser. A sample is forgotten as soon as its file changes,
+        and least recently used samples are evicted by evict once decoded ones take more than `size_limit` bytes.
+    A sample counts as a hit only if it has already been decoded when it's looked up.
+    """
+    size_limit = ...  # type: int
+
+    def __init__(self, size_limit):
+        self.size_limit = size_limit
+        self.hits = 0
+        self.misses = 0
+        self._samples = OrderedDict()
+
+    def __contains__(self, location):
+        known = self._samples.get(location)
+        if known is not None:
+            state, sample = known
+            if state == _file_state(location):
+                self._samples.move_to_end(location)
+                if sample.decoded_size:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                return True
+            del self._samples[location]
+        self.misses += 1
+        return False
+
+    def __getitem__(self, location):
+        return self._samples[location][1]
+
+    def __setitem__(self, location, sample):
+        self._samples[location] = (_file_state(location), sample)
+
+    def __len__(self):
+        return len(self._samples)
+
+    @property
+    def size(self):
+        """Bytes taken by decoded samples."""
+        return sum(sample.decoded_size for _, sample in self._samples.values())
+
+    def evict(self):
+        """Forget least recently used samples until the rest fit into `size_limit`."""
+        total_size = self.size
+        while total_size > self.size_limit and self._samples:
+            _, (_, sample) = self._samples.popitem(last=False)
+            total_size -= sample.decoded_size
@@ -0,0 +1,56 @@
+"""Index of song directories used to resolve files that charts refer to."""
+
+from collections import defaultdict
+from os import path, scandir, stat
+
+from modules.functions import LRUCache
+
+# Charts of the same song share the index for as long as the directory stays unchanged
+_song_indexes = LRUCache(256)
+
+
+class SongIndex(object):
+    """Files of a song directory by their names without extension, built with a single directory scan.
+
+    Names are matched case-insensitively since BM authors mix cases freely.
+    A name can be completed by any extension, so 'kick' matches both 'kick.wav' and 'kick.wav.ogg',
+        which is what looking for 'kick.*' would find.
+    """
+    directory = ...  # type: str
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._entries = defaultdict(list)
+
+        for entry in scandir(directory or '.'):
+            name = entry.name
+            if name.startswith('.'):
+                continue  # Hidden files never match
+            for dot_position, character in enumerate(name):
+                if character == '.':
+                    self._entries[name[:dot_position].lower()].append(name)
+
+    def candidates(self, name):
+        """Return paths of every file `name` with any extension may refer to.
+
+        Files matching the case of `name` exactly are preferred when there are several of them."""
+        found = self._entries.get(name.lower(), [])
+        if len(found) > 1:
+            same_case = [T for T in found if T.startswith(name + '.')]
+            if same_case:
+                found = same_case
+        return [path.join(self.directory, T) for T in found]
+
+
+def song_index(directory):
+    """Return an index of `directory`, reusing the one built for a previous chart from there if it's still valid."""
+    key = path.abspath(directory)
+    modification_time = stat(key).st_mtime_ns
+
+    known = _song_indexes.get(key)
+    if known is not None and known[0] == modification_time:
+        return known[1]
+
+    index = SongIndex(directory)
+    _song_indexes[key] = (modification_time, index)
+    return index
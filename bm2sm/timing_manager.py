@@ -1,49 +1,59 @@
 import operator
+from bisect import bisect_left, bisect_right
 from fractions import Fraction
-from itertools import chain
 from typing import Callable, List, Tuple
 
-from bm2sm.custom_fake_types import BPM, Beat, BeatStop, ChartPosition, Measure, MsStop, Time, TimeSignature
+from bm2sm.custom_fake_types import BPM, Beat, BeatStop, Measure, MsStop, Time, TimeSignature, discretize_ticks
+from bm2sm.definitions import CHART_POSITION_SPLIT
 from bm2sm.exceptions import BeatStopTooShort
-from modules.decorators import transform_args, transform_return
-from modules.fake_types import NonNegativeInt, PositiveFraction
+from bm2sm.profiling import profiled
+from modules.decorators import transform_args
+from modules.fake_types import NonNegativeInt, PositiveFraction, PositiveInt
 
 
 class TimingSectionManager(object):
-    """Manager for all manners of timing changes"""
+    """Manager for all manners of timing changes
+
+    Positions of BPM changes and stops are integer ticks, `ticks_per_measure` of them make a measure.
+    """
     _time_signature_changes = ...  # type: List[Tuple[NonNegativeInt, TimeSignature]]
-    _ms_stops = ...  # type: List[Tuple[ChartPosition, MsStop]]
-    _position_to_time = ...  # type: Callable[ChartPosition, Time]
+    _ms_stops = ...  # type: List[Tuple[NonNegativeInt, MsStop]]
+    _position_to_time = ...  # type: Callable[NonNegativeInt, Time]
     _fixed = ...  # type: bool
-    _bpm_changes = ...  # type: List[Tuple[ChartPosition, BPM]]
+    _bpm_changes = ...  # type: List[Tuple[NonNegativeInt, BPM]]
+    ticks_per_measure = ...  # type: PositiveInt
 
-    def __init__(self):
+    def __init__(self, ticks_per_measure=CHART_POSITION_SPLIT):
         self._bpm_changes = []
         self._fixed = False
         self._position_to_time = None
         self._ms_stops = []
         self._time_signature_changes = []
+        self.ticks_per_measure = ticks_per_measure
+
+    def _snap(self, position):
+        return discretize_ticks(position, 1, self.ticks_per_measure // CHART_POSITION_SPLIT)
 
-    @transform_args(..., ChartPosition, BeatStop)
-    def add_beat_stop(self, measure, stop_duration):
+    def add_beat_stop(self, position, stop_duration):
         # Stepmania does not have real beat stops so we'll have to approximate by adding a close enough ms stop.
         #   BPM changes cannot be added as they will change the topology of the chart.
-        stop_duration = Fraction(stop_duration, 192)
-        closest_bpm = [v for v in self._bpm_changes if v[0] <= measure][-1][1]
+        position = self._snap(position)
+        stop_duration = Fraction(BeatStop(stop_duration), 192)
+        closest_bpm = [v for v in self._bpm_changes if v[0] <= position][-1][1]
         duration_real = stop_duration * Fraction(240000, closest_bpm)
         duration_usable = round(duration_real)
 
         if duration_usable <= 0:
             raise BeatStopTooShort('There is a beat stop that is shorter than 1 ms')
-        self.add_ms_stop(measure, duration_usable)
+        self.add_ms_stop(position, duration_usable)
 
-    @transform_args(..., Measure, MsStop)
-    def add_ms_stop(self, measure, stop_duration):
-        self._ms_stops.append((measure, Fraction(stop_duration, 1000)))
+    @transform_args(..., NonNegativeInt, MsStop)
+    def add_ms_stop(self, position, stop_duration):
+        self._ms_stops.append((position, Fraction(stop_duration, 1000)))
 
-    @transform_args(..., Measure, BPM)
-    def add_bpm_change(self, measure, new_bpm):
-        self._bpm_changes.append((measure, new_bpm))
+    @transform_args(..., NonNegativeInt, BPM)
+    def add_bpm_change(self, position, new_bpm):
+        self._bpm_changes.append((position, new_bpm))
 
     @transform_args(..., Measure, TimeSignature)
     def add_time_signature_change(self, measure, value):
@@ -55,6 +65,7 @@ class TimingSectionManager(object):
     # This must be called after topology of the notefield has been defined.
     # This will make this object functionally immutable.
 
+    @profiled('timing fix')
     def fix(self):
         all_lists = [self._bpm_changes, self._ms_stops]
 
@@ -69,39 +80,39 @@ class TimingSectionManager(object):
             lst.clear()
             lst += result
 
-        def make_bpm_func(period, bpm):
-            fr, to = period
-            coefficient = Fraction(240, bpm)
-
-            def bpm_func(position):
-                position = max(fr, min(to, position))
-                delta = position - fr
-                return delta * coefficient
-
-            return bpm_func
-
-        def make_ms_stop_func(stop_start, stop_duration):
-            def ms_stop_func(position):
-                return stop_duration if position > stop_start else 0
+        # Time at a position is time at the start of the BPM segment containing it
+        #   plus time spent in that segment, plus all the stops before the position.
+        # Both are precomputed for every breakpoint, so each lookup is two bisections.
+        bpm_starts, bpms = zip(*self._bpm_changes)
+        bpm_coefficients = tuple(Fraction(240, bpm) / self.ticks_per_measure for bpm in bpms)
+        bpm_times = [0]
+        for fr, to, coefficient in zip(bpm_starts, bpm_starts[1:], bpm_coefficients):
+            bpm_times.append(bpm_times[-1] + (to - fr) * coefficient)
 
-            return ms_stop_func
+        stop_starts = tuple(stop_start for stop_start, _ in self._ms_stops)
+        stop_times = [0]
+        for _, stop_duration in self._ms_stops:
+            stop_times.append(stop_times[-1] + stop_duration)
 
-        start_points, new_bpm = zip(*self._bpm_changes)
-        start_points = tuple(chain(start_points, (9e4000,)))
-        ranges = zip(start_points[:-1], start_points[1:])
-        steps = zip(ranges, new_bpm)
-
-        bpm_funcs = [make_bpm_func(*T) for T in steps]
-        ms_stop_funcs = [make_ms_stop_func(*T) for T in self._ms_stops]
-
-        full_chain = bpm_funcs + ms_stop_funcs
-
-        @transform_args(ChartPosition)
-        @transform_return(Time)
         def calculate_time_by_position(position):
-            return sum(map(lambda v: v(position), full_chain))
-
-        self._position_to_time = calculate_time_by_position
+            position = self._snap(position)
+            segment = bisect_right(bpm_starts, position) - 1
+            time = stop_times[bisect_left(stop_starts, position)]
+            if segment >= 0:
+                time += bpm_times[segment] + (position - bpm_starts[segment]) * bpm_coefficients[segment]
+            return Time(time)
+
+        # Chords and BGM often share a row, so same positions are looked up over and over
+        known_times = {}
+
+        def memoized_time_by_position(position):
+            try:
+                return known_times[position]
+            except KeyError:
+                time = known_times[position] = calculate_time_by_position(position)
+                return time
+
+        self._position_to_time = memoized_time_by_position
         self._fixed = True
 
 
@@ -113,6 +124,8 @@ class TimingSectionManager(object):
 
         return integer_part, fractional_part
 
+    def _beat_of(self, position):
+        return Beat(4 * Fraction(position, self.ticks_per_measure))
 
     @property
     def position_to_time(self):
@@ -122,9 +135,9 @@ class TimingSectionManager(object):
     def bpm_string(self):
         return ",".join(
             '{}.{:03g}={}.{:03g}'.format(
-                *self._split_fraction_for_string(Beat(4 * measure)),
+                *self._split_fraction_for_string(self._beat_of(position)),
                 *self._split_fraction_for_string(value))
-            for measure, value in self._bpm_changes
+            for position, value in self._bpm_changes
         )
 
     @property
@@ -147,9 +160,9 @@ class TimingSectionManager(object):
     def ms_stops_string(self):
         return ",".join(
             '{}.{:03g}={}.{:03g}'.format(
-                *self._split_fraction_for_string(Beat(4 * measure)),
+                *self._split_fraction_for_string(self._beat_of(position)),
                 *self._split_fraction_for_string(value))
-            for measure, value in self._ms_stops
+            for position, value in self._ms_stops
         )
 
     @property
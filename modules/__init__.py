@@ -1,3 +1,4 @@
 from modules.decorators import *
 from modules.fake_types import *
 from modules.functions import *
+from modules.validation import *
@@ -1,5 +1,3 @@
-from fractions import Fraction
-
 from modules import CastableToInt, PositiveInt, transform_args, transform_return
 
 
@@ -10,4 +8,4 @@ def lcm(a, b):
     while b:
         a, b = b, a % b
     denominator = a
-    return Fraction(numerator, denominator)
+    return numerator // denominator
@@ -1,3 +1,10 @@
+from modules.validation import is_trusted
+
+
+def _bare(func):
+    return func
+
+
 def transform_args(*arg_lambdas, **kwarg_lambdas):
     """Construct a decorator that attempts to transform arguments before calling the function.
 
@@ -25,10 +32,23 @@ def transform_args(*arg_lambdas, **kwarg_lambdas):
         kwarg lambda is only applied when the function is explicitly called with this keyword argument
         Initial kwarg values are NOT transformed.
 
+        With trusted validation level the function is returned undecorated,
+            so it must not rely on transforms to convert its arguments. Use coerce_args for that.
+
     Raises:
         ValueError:
             If ValueError is raised during transform by one of the functions.
     """
+    if is_trusted():
+        return _bare
+    return coerce_args(*arg_lambdas, **kwarg_lambdas)
+
+
+def coerce_args(*arg_lambdas, **kwarg_lambdas):
+    """Same as transform_args, but arguments are transformed at every validation level.
+
+    Meant for functions receiving raw input, such as header values, that rely on transforms to convert it.
+    """
     positional_transform_error_message = """Positional transform failed
     Func: {func}
     Arg#: {arg_pos}
@@ -124,10 +144,15 @@ def transform_return(return_transform, return_message=Ellipsis):
         return_message (Ellipsis, str):
             If not Ellipsis, then if ValueError is raised by the function, it will be reraised with this message
 
+    Notes:
+        With trusted validation level the function is returned undecorated.
+
     Raises:
         ValueError:
             If ValueError is raised during transform.
 """
+    if is_trusted():
+        return _bare
 
     return_transform_error_message = """Return transform failed
     Func: {func}
@@ -2,6 +2,8 @@ import operator
 from fractions import Fraction
 from functools import partial
 
+from modules.validation import is_trusted
+
 
 class Castable(object):
     cast_fail_message = "{it} cannot be converted to {class_name}"  # type: str
@@ -23,23 +25,30 @@ class Castable(object):
         return True
 
     def __new__(cls, it, caller=None):
-        fail_message = cls.cast_fail_message.format(it=it,
-                                                    class_name=cls.__name__)
-        if caller is not None:
-            fail_message += '; source: {}'.format(caller.__name__)
+        if is_trusted():
+            return cls.discretizer(cls.caster(it))
 
         if not cls.pre_check(it):
-            raise ValueError(fail_message)
+            raise ValueError(cls.fail_message(it, caller))
         try:
             value = cls.caster(it)
         except ValueError:
-            raise ValueError(fail_message)
+            raise ValueError(cls.fail_message(it, caller))
         if not cls.post_check(value):
-            raise ValueError(fail_message)
+            raise ValueError(cls.fail_message(it, caller))
         value = cls.discretizer(value)
 
         return value
 
+    @classmethod
+    def fail_message(cls, it, caller=None):
+        """Message of ValueError raised when `it` cannot be cast, only formatted once a cast actually fails."""
+        message = cls.cast_fail_message.format(it=it,
+                                               class_name=cls.__name__)
+        if caller is not None:
+            message += '; source: {}'.format(caller.__name__)
+        return message
+
 
 class CastableToInt(Castable, int):
     caster = int
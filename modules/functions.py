@@ -1,4 +1,6 @@
+import hashlib
 import operator
+from collections import OrderedDict
 from functools import partial, reduce
 from typing import Sequence
 
@@ -26,3 +28,48 @@ is_in = partial(partial, operator.contains)
 # noinspection PyUnusedLocal
 def null_func(*args, **kwargs):
     return True
+
+
+def file_digest(file_path, algorithm='sha1', chunk_size=1 << 20):
+    """Return hex digest of contents of the file at `file_path`"""
+    digest = hashlib.new(algorithm)
+    with open(file_path, 'rb') as in_file:
+        for chunk in iter(partial(in_file.read, chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LRUCache(object):
+    """Mapping that forgets its least recently used entries once it holds more than `max_entries` of them.
+
+    Meant for caches kept by a process for as long as it runs, which would otherwise only ever grow."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __getitem__(self, key):
+        value = self._entries[key]
+        self._entries.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def clear(self):
+        self._entries.clear()
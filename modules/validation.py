@@ -0,0 +1,43 @@
+"""Process-wide level of validation done by transform_args, transform_return and Castable types.
+
+strict:
+    Every decorated call and every cast checks its values and raises ValueError with a detailed message.
+
+trusted:
+    transform_args and transform_return return decorated functions as they are,
+        and Castable types only convert without checking anything.
+    Meant for input that is known to be valid, such as a library that has already been converted once.
+"""
+
+from os import environ
+
+STRICT = 'strict'
+TRUSTED = 'trusted'
+VALIDATION_LEVELS = (STRICT, TRUSTED)
+
+VALIDATION_LEVEL_VARIABLE = 'BM2SM_VALIDATION'
+
+_validation_level = environ.get(VALIDATION_LEVEL_VARIABLE, STRICT)
+if _validation_level not in VALIDATION_LEVELS:
+    _validation_level = STRICT
+
+
+def get_validation_level():
+    return _validation_level
+
+
+def is_trusted():
+    return _validation_level == TRUSTED
+
+
+def set_validation_level(level):
+    """Set validation level of this process and processes started by it.
+
+    Decorators are resolved when functions are decorated,
+        so this has to be called before modules using them are imported.
+    """
+    global _validation_level
+    if level not in VALIDATION_LEVELS:
+        raise ValueError('Unknown validation level: {}'.format(level))
+    _validation_level = level
+    environ[VALIDATION_LEVEL_VARIABLE] = level
@@ -0,0 +1,95 @@
+import os
+import unittest
+from os import listdir, makedirs, path
+from tempfile import TemporaryDirectory
+
+from benchmarks.chart_generator import write_chart
+from bm2sm.batch import convert_song, failure_line, make_tasks, run_in_workers
+from bm2sm.exceptions import EmptyChart
+from bm2sm.progress import NullSink, set_sink
+
+
+class MakeTasksTest(unittest.TestCase):
+    def out_dirs(self, charts):
+        return [T[1] for T in make_tasks(charts, 'out', 'S1234567', 'ALL', {})]
+
+    def test_song_directory_names_output_directory(self):
+        charts = [path.abspath(path.join('songs', 'foo', 'foo.bms')),
+                  path.abspath(path.join('songs', 'foo', 'foo_hyper.bme')),
+                  path.abspath(path.join('songs', 'bar', 'bar.bms'))]
+        self.assertEqual(self.out_dirs(charts),
+                         [path.join('out', 'foo'), path.join('out', 'foo'), path.join('out', 'bar')])
+
+    def test_same_named_song_directories_are_kept_apart(self):
+        charts = [path.abspath(path.join('songs', 'packA', 'foo', 'foo.bms')),
+                  path.abspath(path.join('songs', 'packB', 'foo', 'foo.bms')),
+                  path.abspath(path.join('songs', 'packB', 'bar', 'bar.bms'))]
+        self.assertEqual(self.out_dirs(charts),
+                         [path.join('out', 'packA', 'foo'), path.join('out', 'packB', 'foo'), path.join('out', 'bar')])
+
+    def test_nested_same_named_song_directories_are_kept_apart(self):
+        charts = [path.abspath(path.join('songs', 'foo', 'foo.bms')),
+                  path.abspath(path.join('songs', 'foo', 'extra', 'foo', 'foo.bms'))]
+        out_dirs = self.out_dirs(charts)
+        self.assertNotEqual(out_dirs[0], out_dirs[1])
+
+    def test_without_out_dir_charts_stay_where_they_are(self):
+        chart = path.abspath(path.join('songs', 'foo', 'foo.bms'))
+        self.assertEqual(make_tasks([chart], None, 'S1234567', 'ALL', {})[0][1], path.dirname(chart))
+
+
+
+class ConvertSongTest(unittest.TestCase):
+    def setUp(self):
+        self.previous_sink = set_sink(NullSink())
+        self.temp_dir = TemporaryDirectory()
+        self.song_dir = path.join(self.temp_dir.name, 'foo')
+        self.out_dir = path.join(self.temp_dir.name, 'out')
+        makedirs(self.song_dir)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        set_sink(self.previous_sink)
+
+    def write_broken_chart(self, name):
+        with open(path.join(self.song_dir, name), 'w', encoding='utf-8') as chart_file:
+            chart_file.write('#PLAYER 1\n#BPM 120\n#RANDOM 2\n#IF 1\n#00111:01\n#ENDIF\n')
+
+    def test_broken_chart_does_not_stop_the_others(self):
+        write_chart(path.join(self.song_dir, 'foo_normal.bms'), 64)
+        write_chart(path.join(self.song_dir, 'foo_hyper.bms'), 128)
+        self.write_broken_chart('foo_random.bms')
+
+        parsers, failures = convert_song(self.song_dir, self.out_dir, 'S1234567', 'SM')
+        self.assertEqual(sorted(T.BM_file_name for T in parsers), ['foo_hyper', 'foo_normal'])
+        self.assertEqual([(path.basename(T[0]), T[1]) for T in failures],
+                         [('foo_random.bms', 'UnsupportedControlFlowError')])
+        self.assertEqual(listdir(self.out_dir), ['foo.sm'])
+
+    def test_song_without_convertible_charts_is_empty(self):
+        self.write_broken_chart('foo_random.bms')
+        with self.assertRaises(EmptyChart):
+            convert_song(self.song_dir, self.out_dir, 'S1234567', 'SM')
+
+
+
+def _task_killing_its_worker(task):
+    if task[0] == 'killer':
+        os._exit(1)
+    return task[0], None, None, None
+
+
+class RunInWorkersTest(unittest.TestCase):
+    def test_dead_worker_fails_only_its_task(self):
+        tasks = [(T,) for T in ('first', 'second', 'killer', 'third', 'fourth')]
+        results = sorted(run_in_workers(_task_killing_its_worker, tasks, 2))
+        self.assertEqual([T[0] for T in results], ['first', 'fourth', 'killer', 'second', 'third'])
+        self.assertEqual([T[1] for T in results], [None, None, 'WorkerDied', None, None])
+
+    def test_failure_without_message_has_no_separator(self):
+        self.assertEqual(failure_line('foo.bms', 'EmptyChart', ''), 'FAIL  foo.bms: EmptyChart')
+        self.assertEqual(failure_line('foo.bms', 'StopIsNotDefined', '01'), 'FAIL  foo.bms: StopIsNotDefined: 01')
+
+
+if __name__ == '__main__':
+    unittest.main()
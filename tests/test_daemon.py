@@ -0,0 +1,82 @@
+import os
+import signal
+import time
+import unittest
+from os import path
+from tempfile import TemporaryDirectory
+
+from benchmarks.chart_generator import write_chart
+from bm2sm.daemon import ConversionDaemon
+
+# Longest a job is waited for, in seconds
+TIMEOUT = 60
+
+
+class ConversionDaemonTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.daemon = ConversionDaemon(1)
+
+    def tearDown(self):
+        self.daemon.close()
+        self.temp_dir.cleanup()
+
+    def chart(self, name, notes=64):
+        chart_path = path.join(self.temp_dir.name, name)
+        write_chart(chart_path, notes)
+        return chart_path
+
+    def wait_for(self, job_id, states):
+        deadline = time.time() + TIMEOUT
+        while time.time() < deadline:
+            job = self.daemon.job(job_id)
+            if job['state'] in states:
+                return job
+            time.sleep(0.01)
+        self.fail('Job {} is still {}'.format(job_id, self.daemon.job(job_id)['state']))
+
+    def test_job_lifecycle(self):
+        chart = self.chart('foo.bms')
+        job_id = self.daemon.submit(chart, mode='SM')
+        self.assertIn(self.daemon.job(job_id)['state'], ('queued', 'running', 'done'))
+
+        job = self.wait_for(job_id, ('done', 'failed'))
+        self.assertEqual(job['state'], 'done')
+        self.assertTrue(path.isfile(path.join(self.temp_dir.name, 'foo.sm')))
+
+        status = self.daemon.status()
+        self.assertEqual((status['completed'], status['failed'], status['queue_depth']), (1, 0, 0))
+        self.assertIsNone(self.daemon.job(job_id + 1))
+
+    def test_failed_job(self):
+        job_id = self.daemon.submit(path.join(self.temp_dir.name, 'missing.bms'), mode='SM')
+        job = self.wait_for(job_id, ('done', 'failed'))
+        self.assertEqual(job['state'], 'failed')
+        self.assertIn('error', job)
+        self.assertEqual(self.daemon.status()['failed'], 1)
+
+    def test_unknown_options(self):
+        with self.assertRaises(ValueError):
+            self.daemon.submit(self.chart('foo.bms'), mode='VIDEO')
+        with self.assertRaises(ValueError):
+            self.daemon.submit(self.chart('foo.bms'), mix_engine='nonexistent')
+
+    @unittest.skipUnless(hasattr(signal, 'SIGKILL'), 'Workers cannot be killed here')
+    def test_dead_worker_fails_its_job_and_is_replaced(self):
+        job_id = self.daemon.submit(self.chart('long.bms', 100000), mode='SM')
+        job = self.wait_for(job_id, ('running', 'done', 'failed'))
+        self.assertEqual(job['state'], 'running', 'Job has finished before its worker could be killed')
+        os.kill(self.daemon._processes[job['worker']].pid, signal.SIGKILL)
+
+        job = self.wait_for(job_id, ('done', 'failed'))
+        self.assertEqual(job['error'], 'WorkerDied')
+
+        # Replacement takes jobs that come next
+        next_job_id = self.daemon.submit(self.chart('foo.bms'), mode='SM')
+        self.assertEqual(self.wait_for(next_job_id, ('done', 'failed'))['state'], 'done')
+        status = self.daemon.status()
+        self.assertEqual((status['restarted_workers'], status['alive_workers']), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
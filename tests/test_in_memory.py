@@ -0,0 +1,68 @@
+import unittest
+from os import path
+from tempfile import TemporaryDirectory
+
+from benchmarks.chart_generator import write_song
+from bm2sm.BM_parser import BMChartParser
+from bm2sm.exceptions import UndecidableAudioFile
+from bm2sm.in_memory import convert_chart_data
+from bm2sm.progress import NullSink, set_sink
+
+
+class ConvertChartDataTest(unittest.TestCase):
+    def setUp(self):
+        self.previous_sink = set_sink(NullSink())
+        self.temp_dir = TemporaryDirectory()
+        self.chart_path = write_song(self.temp_dir.name, 200, wav_count=4)
+        with open(self.chart_path, 'rb') as chart_file:
+            self.chart_data = chart_file.read()
+        self.resolved = []
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        set_sink(self.previous_sink)
+
+    def resolve_sample(self, name):
+        self.resolved.append(name)
+        try:
+            with open(path.join(self.temp_dir.name, name), 'rb') as sample_file:
+                return sample_file.read()
+        except FileNotFoundError:
+            return None
+
+    def parse_from_disk(self, load_sounds):
+        return BMChartParser(self.chart_path, None, 'S1234567', load_sounds)
+
+    def test_sm_is_same_as_from_disk(self):
+        parser = self.parse_from_disk(False)
+        parser.SM_converter.compose_chart()
+        with open(parser.SM_file_path, encoding='utf-8', newline='') as sm_file:
+            expected = sm_file.read()
+
+        converted = convert_chart_data(self.chart_data, mode='SM', name=parser.BM_file_name)
+        self.assertEqual(converted.sm, expected)
+        self.assertIsNone(converted.audio)
+        self.assertEqual(self.resolved, [])
+
+    def test_audio_is_same_as_from_disk(self):
+        expected = self.parse_from_disk(True).OGG_converter.mix('layered').raw_data
+
+        converted = convert_chart_data(self.chart_data, self.resolve_sample)
+        self.assertTrue(expected)
+        self.assertEqual(converted.audio, expected)
+        self.assertIsNotNone(converted.sm)
+        # Every sample is asked for once, however many times the chart plays it
+        self.assertEqual(len(self.resolved), 4)
+        self.assertEqual(len(set(self.resolved)), 4)
+
+    def test_missing_sample(self):
+        with self.assertRaises(UndecidableAudioFile):
+            convert_chart_data(self.chart_data, lambda name: None)
+
+    def test_audio_needs_resolver(self):
+        with self.assertRaises(ValueError):
+            convert_chart_data(self.chart_data)
+
+
+if __name__ == '__main__':
+    unittest.main()
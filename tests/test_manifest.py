@@ -0,0 +1,45 @@
+import unittest
+from io import StringIO
+from os import listdir, makedirs, path
+from tempfile import TemporaryDirectory
+
+from benchmarks.chart_generator import write_chart
+from bm2sm.batch import run_batch
+from bm2sm.manifest import Manifest
+from bm2sm.progress import NullSink, set_sink
+
+
+class IncrementalBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.previous_sink = set_sink(NullSink())
+        self.temp_dir = TemporaryDirectory()
+        song_dir = path.join(self.temp_dir.name, 'songs', 'foo')
+        makedirs(song_dir)
+        self.chart = path.join(song_dir, 'foo.bms')
+        write_chart(self.chart, 64)
+        self.manifest = Manifest(path.join(self.temp_dir.name, 'manifest.sqlite3'))
+
+    def tearDown(self):
+        self.manifest.close()
+        self.temp_dir.cleanup()
+        set_sink(self.previous_sink)
+
+    def convert(self, out_dir):
+        report = StringIO()
+        run_batch([self.chart], path.join(self.temp_dir.name, out_dir), 'S1234567', 'SM', 1,
+                  report=report, manifest=self.manifest)
+        return report.getvalue()
+
+    def test_unchanged_chart_is_skipped(self):
+        self.assertIn('OK    ', self.convert('outA'))
+        self.assertIn('SKIP  ', self.convert('outA'))
+
+    def test_changed_out_dir_converts_again(self):
+        self.convert('outA')
+        report = self.convert('outB')
+        self.assertNotIn('SKIP  ', report)
+        self.assertEqual(listdir(path.join(self.temp_dir.name, 'outB', 'foo')), ['foo.sm'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import unittest
+from os import listdir, path
+from tempfile import TemporaryDirectory
+
+from pydub import AudioSegment
+
+from benchmarks.chart_generator import keysound_name, write_keysounds
+from bm2sm.data_structures import SoundSample
+from bm2sm.definitions import DEFAULT_CHANNELS, DEFAULT_FRAME_RATE, DEFAULT_SAMPLE_WIDTH
+from bm2sm.sample_cache import SampleCache, SampleMemory, canonical_segment
+
+
+class SampleCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.sample_dir = path.join(self.temp_dir.name, 'samples')
+        self.cache_dir = path.join(self.temp_dir.name, 'cache')
+        os.makedirs(self.sample_dir)
+        self.decoded = []
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def decoder(self, location):
+        self.decoded.append(location)
+        return AudioSegment.from_file(location)
+
+    def samples(self, amount, duration_ms=10):
+        write_keysounds(self.sample_dir, amount, duration_ms)
+        return [path.join(self.sample_dir, keysound_name(T)) for T in range(1, amount + 1)]
+
+    def test_hit_is_not_decoded_again(self):
+        sample, = self.samples(1)
+        decoded = SampleCache(self.cache_dir, 1 << 30).load(sample, self.decoder)
+        cached = SampleCache(self.cache_dir, 1 << 30).load(sample, self.decoder)
+
+        self.assertEqual(self.decoded, [sample])
+        self.assertEqual(cached.raw_data, decoded.raw_data)
+        self.assertEqual((cached.frame_rate, cached.sample_width, cached.channels),
+                         (DEFAULT_FRAME_RATE, DEFAULT_SAMPLE_WIDTH, DEFAULT_CHANNELS))
+
+    def test_changed_sample_is_decoded_again(self):
+        sample, = self.samples(1)
+        cache = SampleCache(self.cache_dir, 1 << 30)
+        cache.load(sample, self.decoder)
+        write_keysounds(self.sample_dir, 1, duration_ms=20)
+        cache.load(sample, self.decoder)
+        self.assertEqual(self.decoded, [sample, sample])
+
+    def test_cache_is_evicted_down_to_its_limit(self):
+        samples = self.samples(40)
+        entry_size = len(canonical_segment(AudioSegment.from_file(samples[0])).raw_data)
+        size_limit = entry_size * 10
+
+        cache = SampleCache(self.cache_dir, size_limit)
+        for sample in samples:
+            cache.load(sample, self.decoder)
+        cache_size = sum(path.getsize(path.join(self.cache_dir, T)) for T in listdir(self.cache_dir))
+        self.assertLessEqual(cache_size, size_limit)
+        # Most recently used samples are the ones kept
+        cache.load(samples[-1], self.decoder)
+        self.assertEqual(len(self.decoded), len(samples))
+
+    @unittest.skipUnless(path.isdir('/proc/self/fd'), 'Open files are only counted on Linux')
+    def test_hits_keep_no_files_open(self):
+        samples = self.samples(300)
+        SampleCache(self.cache_dir, 1 << 30).load(samples[0])
+        for sample in samples:
+            SampleCache(self.cache_dir, 1 << 30).load(sample)
+
+        open_files = len(listdir('/proc/self/fd'))
+        cache = SampleCache(self.cache_dir, 1 << 30)
+        segments = [cache.load(T, self.decoder) for T in samples]
+        self.assertEqual(self.decoded, [])
+        self.assertEqual(len(segments), len(samples))
+        self.assertLessEqual(len(listdir('/proc/self/fd')), open_files)
+
+
+class SampleMemoryTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        write_keysounds(self.temp_dir.name, 3, 10)
+        self.samples = [path.join(self.temp_dir.name, keysound_name(T)) for T in range(1, 4)]
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_only_decoded_samples_are_hits(self):
+        memory = SampleMemory(1 << 30)
+        self.assertNotIn(self.samples[0], memory)
+        memory[self.samples[0]] = SoundSample(self.samples[0])
+        self.assertIn(self.samples[0], memory)
+        memory[self.samples[0]].segment
+        self.assertIn(self.samples[0], memory)
+        self.assertEqual((memory.hits, memory.misses), (1, 2))
+
+    def test_least_recently_used_samples_are_evicted(self):
+        memory = SampleMemory(1 << 30)
+        for sample in self.samples:
+            memory[sample] = SoundSample(sample)
+            memory[sample].segment
+        memory.size_limit = memory.size - 1
+        self.assertIn(self.samples[0], memory)
+        memory.evict()
+        self.assertEqual(len(memory), 2)
+        self.assertIn(self.samples[0], memory)
+        self.assertNotIn(self.samples[1], memory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import io
+import unittest
+from math import gcd
+from os import path
+from tempfile import TemporaryDirectory
+
+from benchmarks.chart_generator import write_chart
+from bm2sm.BM_parser import BMChartParser
+from bm2sm.definitions import Representations
+from bm2sm.progress import NullSink, set_sink
+from bm2sm.SM_converter import SMChartConverter
+
+
+def dense_notes(converter):
+    """Measures of the chart built as a full grid of rows first, the way the composer used to do it."""
+    ticks_per_measure = converter._parent.ticks_per_measure
+    measure_splits = {}
+    for obj in converter.objects:
+        measure, local_position = divmod(obj.position, ticks_per_measure)
+        denominator = ticks_per_measure // gcd(local_position, ticks_per_measure)
+        split = measure_splits.get(measure, 4)
+        measure_splits[measure] = split * denominator // gcd(split, denominator)
+
+    measures = [[[Representations.NOTHING] * len(converter.keys) for _ in range(measure_splits.get(T, 4))]
+                for T in range(max(measure_splits) + 1)]
+    for obj in converter.objects:
+        if obj.key not in converter.keys:
+            continue
+        measure, local_position = divmod(obj.position, ticks_per_measure)
+        row = local_position * measure_splits[measure] // ticks_per_measure
+        measures[measure][row][converter.keys.index(obj.key)] = obj.symbol
+
+    return '\n,\n'.join('\n'.join(''.join(row) for row in measure) for measure in measures)
+
+
+class WriteSMTest(unittest.TestCase):
+    def setUp(self):
+        self.previous_sink = set_sink(NullSink())
+        self.temp_dir = TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        set_sink(self.previous_sink)
+
+    def parse(self, keys='S1234567', **kwargs):
+        chart_path = path.join(self.temp_dir.name, 'foo.bms')
+        write_chart(chart_path, 600, **kwargs)
+        return BMChartParser(chart_path, None, keys, False)
+
+    def written(self, parser):
+        out_file = io.StringIO()
+        SMChartConverter.write_sm(out_file, parser.OGG_file_name, (parser.SM_converter,))
+        return out_file.getvalue()
+
+    def expected(self, parser):
+        converter = parser.SM_converter
+        return '\n'.join((converter.compose_header(parser.OGG_file_name),
+                          converter._SM_notes_format.format(**{**converter._meta_data,
+                                                               'measures': dense_notes(converter)})))
+
+    def test_same_as_dense_grid(self):
+        for kwargs in ({}, {'ln_type': 1}, {'ln_obj': True, 'rows_per_measure': 12},
+                       {'time_signature_density': 0.3, 'bpm_density': 0.3, 'stop_density': 0.3}):
+            parser = self.parse(**kwargs)
+            self.assertEqual(self.written(parser), self.expected(parser), kwargs)
+
+    def test_duplicated_and_unmapped_keys(self):
+        # First lane of a duplicated key gets the objects, lanes 6 and 7 are dropped
+        for keys in ('S1123455', '11234567', 'S12345XX'):
+            parser = self.parse(keys=keys)
+            self.assertEqual(self.written(parser), self.expected(parser), keys)
+
+    def test_empty_measures(self):
+        parser = self.parse()
+        converter = parser.SM_converter
+        converter.objects = [T for T in converter.objects if T.position // parser.ticks_per_measure not in (0, 2, 3)]
+        self.assertEqual(self.written(parser), self.expected(parser))
+
+    def test_file_is_the_same_as_text(self):
+        parser = self.parse()
+        parser.SM_converter.compose_chart()
+        with open(parser.SM_file_path, encoding='utf-8', newline='') as sm_file:
+            self.assertEqual(sm_file.read(), self.written(parser))
+
+
+if __name__ == '__main__':
+    unittest.main()
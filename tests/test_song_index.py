@@ -0,0 +1,55 @@
+import os
+import unittest
+from os import path
+from tempfile import TemporaryDirectory
+
+from bm2sm.song_index import song_index
+
+
+class SongIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = TemporaryDirectory()
+        self.directory = self.temporary_directory.name
+        for name in ('kick.wav', 'kick.wav.ogg', 'Snare.ogg', 'snare.wav', 'hat.OGG', '.hidden.wav'):
+            open(path.join(self.directory, name), 'wb').close()
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def candidates(self, index, name):
+        return sorted(path.basename(T) for T in index.candidates(name))
+
+    def test_candidates(self):
+        index = song_index(self.directory)
+        self.assertEqual(self.candidates(index, 'kick'), ['kick.wav', 'kick.wav.ogg'])
+        self.assertEqual(self.candidates(index, 'kick.wav'), ['kick.wav.ogg'])
+        self.assertEqual(self.candidates(index, 'HAT'), ['hat.OGG'])
+        self.assertEqual(self.candidates(index, 'hidden'), [])
+        self.assertEqual(self.candidates(index, 'missing'), [])
+        self.assertEqual(index.candidates('hat')[0], path.join(self.directory, 'hat.OGG'))
+
+    def test_same_case_is_preferred(self):
+        index = song_index(self.directory)
+        self.assertEqual(self.candidates(index, 'Snare'), ['Snare.ogg'])
+        self.assertEqual(self.candidates(index, 'snare'), ['snare.wav'])
+        self.assertEqual(self.candidates(index, 'SNARE'), ['Snare.ogg', 'snare.wav'])
+
+    def test_index_is_reused_while_directory_is_unchanged(self):
+        index = song_index(self.directory)
+        self.assertIs(song_index(self.directory), index)
+        self.assertIs(song_index(path.join(self.directory, '.')), index)
+
+    def test_index_is_rebuilt_when_directory_changes(self):
+        index = song_index(self.directory)
+        open(path.join(self.directory, 'clap.wav'), 'wb').close()
+        # Make sure the change is seen even on file systems with coarse timestamps
+        modification_time = os.stat(self.directory).st_mtime_ns + 10 ** 9
+        os.utime(self.directory, ns=(modification_time, modification_time))
+
+        rebuilt = song_index(self.directory)
+        self.assertIsNot(rebuilt, index)
+        self.assertEqual(self.candidates(rebuilt, 'clap'), ['clap.wav'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import random
+import unittest
+from fractions import Fraction
+
+from bm2sm.custom_fake_types import Time
+from bm2sm.timing_manager import TimingSectionManager
+
+
+def linear_time(position, bpm_changes, ms_stops, ticks_per_measure):
+    """Time at `position` summed over every BPM segment and stop, the way lookups used to be done."""
+    starts = [T[0] for T in bpm_changes] + [float('inf')]
+    time = Fraction(0)
+    for (start, bpm), end in zip(bpm_changes, starts[1:]):
+        time += (max(start, min(end, position)) - start) * Fraction(240, bpm) / ticks_per_measure
+    for stop_start, stop_duration in ms_stops:
+        if position > stop_start:
+            time += Fraction(stop_duration, 1000)
+    return Time(time)
+
+
+class PositionToTimeTest(unittest.TestCase):
+    def make_manager(self, seed):
+        rng = random.Random(seed)
+        manager = TimingSectionManager()
+        ticks = manager.ticks_per_measure
+        bpm_changes = [(0, 150)] + [(rng.randrange(1, 64 * ticks), rng.randrange(60, 300)) for _ in range(20)]
+        ms_stops = [(rng.randrange(0, 64 * ticks), rng.randrange(1, 2000)) for _ in range(10)]
+        for position, bpm in bpm_changes:
+            manager.add_bpm_change(position, bpm)
+        for position, duration in ms_stops:
+            manager.add_ms_stop(position, duration)
+        manager.fix()
+        # Later changes at the same position win, the way fix keeps them
+        return manager, sorted(dict(bpm_changes).items()), sorted(dict(ms_stops).items()), rng
+
+    def test_table_matches_linear_lookup(self):
+        for seed in range(5):
+            manager, bpm_changes, ms_stops, rng = self.make_manager(seed)
+            ticks = manager.ticks_per_measure
+            positions = [rng.randrange(0, 70 * ticks) for _ in range(200)]
+            # Breakpoints and positions right next to them are where off-by-one errors live
+            for breakpoint, _ in bpm_changes + ms_stops:
+                positions.extend((breakpoint, breakpoint + 1, max(0, breakpoint - 1)))
+
+            for position in positions:
+                self.assertEqual(manager.position_to_time(position),
+                                 linear_time(position, bpm_changes, ms_stops, ticks),
+                                 'seed {}, position {}'.format(seed, position))
+
+    def test_repeated_lookups_agree(self):
+        manager, _, _, _ = self.make_manager(0)
+        position = 5 * manager.ticks_per_measure
+        self.assertEqual(manager.position_to_time(position), manager.position_to_time(position))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+from bm2sm.BM_tokenizer import (ChannelMessage, HeaderMessage, StpMessage, TimeSignatureMessage, tokenize,
+                                tokenize_line)
+
+
+class TokenizeLineTest(unittest.TestCase):
+    def test_channel_message(self):
+        self.assertEqual(tokenize_line('#00111:0101\n'), ChannelMessage(1, '11', '0101'))
+        self.assertEqual(tokenize_line('#0011a:01'), ChannelMessage(1, '1A', '01'))
+
+    def test_time_signature_is_not_a_channel(self):
+        self.assertEqual(tokenize_line('#00102:0.75'), TimeSignatureMessage(1, '0.75'))
+
+    def test_stp_message(self):
+        self.assertEqual(tokenize_line('#STP 001.500 1000'), StpMessage('001', '500', '1000'))
+
+    def test_header_message(self):
+        self.assertEqual(tokenize_line('#TITLE foo bar\r\n'), HeaderMessage('TITLE', 'foo bar'))
+        self.assertEqual(tokenize_line('  #BPM 120'), HeaderMessage('BPM', '120'))
+        self.assertEqual(tokenize_line('#WAV0Z kick.wav'), HeaderMessage('WAV0Z', 'kick.wav'))
+
+    def test_not_a_command(self):
+        for line in ('', '*---- comment', 'comment #BPM 120', '#RANDOM', '#00111:'):
+            self.assertIsNone(tokenize_line(line), line)
+
+
+class TokenizeTest(unittest.TestCase):
+    def test_skips_everything_but_commands(self):
+        lines = ['*---- HEADER', '#BPM 150', '', '#00111:01', '#STP 002.000 500']
+        self.assertEqual(list(tokenize(lines)), [HeaderMessage('BPM', '150'),
+                                                 ChannelMessage(1, '11', '01'),
+                                                 StpMessage('002', '000', '500')])
+
+
+if __name__ == '__main__':
+    unittest.main()